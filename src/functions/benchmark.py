@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import contextlib
+import tracemalloc
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+# The benchmarks time statistic_func(), which calls plt.show(). A non-interactive backend, set before pyplot is imported (also by
+# backend.py), keeps it from opening windows and blocking the run.
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from loader import load_local_data
+import backend
+from backend import data_wrangling, calculate_completion_rate, calculate_avg_time_per_step, error_rate, drop_off_rate, drop_off_rates, statistic_func
+from duckdb_backend import DuckDBBackend
+from synthetic import generate_data, write_raw_data
+from loader import RAW_FILES
+from funnel import FunnelMetrics
+from sharding import sharded_funnel_metrics
+from resampling import bootstrap_lift, permutation_test
+
+
+def time_call(func, *args, repeat=3, **kwargs):
+    # This function runs a function several times and returns the best time in seconds. The best time is used because it is the least affected by other processes running on the machine.
+
+    # Parameters
+    # func = function to time.
+    # repeat = how many times the function runs.
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def benchmark_load_data(data_dir='data/raw', repeat=3):
+    # This function compares loading the raw files by parsing the CSVs (cold) against reading the Parquet cache (warm).
+
+    # Parameters
+    # data_dir = local folder with the raw CSV files.
+    # repeat = how many times each load runs.
+
+    cache_dir = tempfile.mkdtemp()
+
+    try:
+        # Cold load: the cache is emptied before every run so the CSVs are always parsed.
+        def cold_load():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            load_local_data(data_dir, cache_dir)
+
+        cold_seconds = time_call(cold_load, repeat=repeat)
+
+        # Parsing without the cache, to see how much writing the Parquet files adds to the cold load.
+        csv_seconds = time_call(load_local_data, data_dir, None, repeat=repeat)
+
+        # Warm load: the cache was filled by the last cold load.
+        warm_seconds = time_call(load_local_data, data_dir, cache_dir, repeat=repeat)
+
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = pd.DataFrame({'load': ['csv (no cache)', 'cold cache', 'warm cache'],
+                            'seconds': [csv_seconds, cold_seconds, warm_seconds]})
+    results['speedup_vs_csv'] = csv_seconds / results['seconds']
+
+    return results
+
+
+def benchmark_funnel_metrics(data, repeat=3):
+    # This function compares calling the four metric functions in backend.py for Control, Test and overall against one FunnelMetrics pass.
+
+    # Parameters
+    # data = dataset with client_id, Variation, process_step and date_time, like web_group_experiment.
+    # repeat = how many times each approach runs.
+
+    def backend_functions():
+        for variation in ['Control', 'Test', None]:
+            calculate_completion_rate(data, variation)
+            error_rate(data, variation)
+            drop_off_rate(data, variation)
+        calculate_avg_time_per_step(data)
+
+    def funnel_metrics():
+        FunnelMetrics(data).summary()
+
+    backend_seconds = time_call(backend_functions, repeat=repeat)
+    funnel_seconds = time_call(funnel_metrics, repeat=repeat)
+
+    return pd.DataFrame({'approach': ['backend functions', 'FunnelMetrics'],
+                         'seconds': [backend_seconds, funnel_seconds],
+                         'speedup': [1.0, backend_seconds / funnel_seconds]})
+
+
+def benchmark_resampling(n_clients=10000, n_resamples=10000, n_jobs_options=(1, None), seed=0):
+    # This function measures how many bootstrap and permutation resamples per second the resampling engine draws.
+
+    # Parameters
+    # n_clients = number of clients in each group. The values are simulated completions (0 or 1).
+    # n_resamples = number of resamples per run.
+    # n_jobs_options = numbers of worker processes to compare. None uses every CPU.
+    # seed = seed of the simulated data and of the resamples.
+
+    rng = np.random.default_rng(seed)
+    test_values = (rng.random(n_clients) < 0.69).astype('float64')
+    control_values = (rng.random(n_clients) < 0.66).astype('float64')
+
+    results = []
+    for n_jobs in n_jobs_options:
+        for name, func in [('bootstrap', bootstrap_lift), ('permutation', permutation_test)]:
+            seconds = time_call(func, test_values, control_values, n_resamples, seed=seed, n_jobs=n_jobs, repeat=1)
+            results.append({'method': name, 'n_jobs': n_jobs, 'seconds': seconds, 'resamples_per_second': n_resamples / seconds})
+
+    return pd.DataFrame(results)
+
+
+def benchmark_engines(n_clients_options=(100_000, 1_000_000), memory_limit=None, repeat=1, seed=0):
+    # This function compares data_wrangling() and the metric functions run by pandas (backend.py) and by DuckDB (DuckDBBackend), on
+    # simulated data of growing size. DuckDB is timed both on the dataframes and on Parquet files, its out of core mode.
+
+    # Parameters
+    # n_clients_options = numbers of clients to simulate with synthetic.py. There are about 7 events per client.
+    # memory_limit = memory limit of DuckDB, for example '2GB'.
+    # repeat = how many times each run is timed.
+    # seed = seed of the simulated data.
+
+    parquet_dir = tempfile.mkdtemp()
+    engine = DuckDBBackend(memory_limit=memory_limit, temp_directory=os.path.join(parquet_dir, 'spill'))
+    results = []
+
+    def metrics(engine, data):
+        for variation in ['Control', 'Test', None]:
+            engine.calculate_completion_rate(data, variation)
+            engine.error_rate(data, variation)
+            engine.drop_off_rate(data, variation)
+        engine.calculate_avg_time_per_step(data)
+
+    try:
+        for n_clients in n_clients_options:
+            client_profiles, experiment_roster, web_group = generate_data(n_clients, seed=seed)
+            frames = [web_group, experiment_roster, client_profiles]
+            paths = [os.path.join(parquet_dir, f"{name}.parquet") for name in ['web_group', 'experiment_roster', 'client_profiles']]
+            for frame, path in zip(frames, paths):
+                frame.to_parquet(path)
+
+            web_group_experiment = backend.data_wrangling(*frames)[4]
+            outputs = engine.write_wrangling(*paths, os.path.join(parquet_dir, 'wrangled'))
+
+            runs = [('pandas', 'dataframes', lambda: backend.data_wrangling(*frames), lambda: metrics(backend, web_group_experiment)),
+                    ('duckdb', 'dataframes', lambda: engine.data_wrangling(*frames), lambda: metrics(engine, web_group_experiment)),
+                    ('duckdb', 'parquet', lambda: engine.write_wrangling(*paths, os.path.join(parquet_dir, 'wrangled')),
+                     lambda: metrics(engine, outputs['web_group_experiment']))]
+
+            for engine_name, source, wrangling, metric_functions in runs:
+                results.append({'n_clients': n_clients, 'n_events': len(frames[0]), 'engine': engine_name, 'source': source,
+                                'wrangling_seconds': time_call(wrangling, repeat=repeat),
+                                'metrics_seconds': time_call(metric_functions, repeat=repeat)})
+    finally:
+        engine.close()
+        shutil.rmtree(parquet_dir, ignore_errors=True)
+
+    return pd.DataFrame(results)
+
+
+def measure_call(func, *args, repeat=1, **kwargs):
+    # This function returns the best time in seconds of a function and its peak memory in bytes. The peak is the most memory allocated at
+    # once while the function ran, above what was allocated before, measured with tracemalloc in a separate run so it doesn't slow the timing.
+    # tracemalloc sees the memory of Python objects and numpy arrays, not memory allocated by Arrow or DuckDB.
+
+    # Parameters
+    # func = function to measure.
+    # repeat = how many times the function is timed.
+
+    seconds = time_call(func, *args, repeat=repeat, **kwargs)
+
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak_bytes
+
+
+def backend_calls(client_profiles, experiment_roster, web_group):
+    # Returns the name and call of every function in backend.py, with the data each one takes.
+
+    outputs = data_wrangling(web_group, experiment_roster, client_profiles)
+    final_rooster_process_counts_profile, web_group_experiment = outputs[1], outputs[4]
+
+    def quiet_statistic_func(data, evaluator, stat_test):
+        # Hides the printed results and closes the plots, so the timings only include the tests.
+        with contextlib.redirect_stdout(None):
+            statistic_func(data, evaluator, stat_test, 0.05)
+        plt.close('all')
+
+    return [('data_wrangling', lambda: data_wrangling(web_group, experiment_roster, client_profiles)),
+            ('calculate_completion_rate', lambda: calculate_completion_rate(web_group_experiment)),
+            ('calculate_avg_time_per_step', lambda: calculate_avg_time_per_step(web_group_experiment)),
+            ('error_rate', lambda: error_rate(web_group_experiment)),
+            ('drop_off_rate', lambda: drop_off_rate(web_group_experiment)),
+            ('drop_off_rates', lambda: drop_off_rates(web_group_experiment)),
+            ('statistic_func t-test', lambda: quiet_statistic_func(final_rooster_process_counts_profile, 'age', 't-test')),
+            ('statistic_func chi-test', lambda: quiet_statistic_func(final_rooster_process_counts_profile.copy(), 'balance', 'chi-test')),
+            ('statistic_func two-proportion z-test', lambda: quiet_statistic_func(web_group_experiment, 'completion', 'two-proportion z-test')),
+            ('statistic_func one-sided z-test', lambda: quiet_statistic_func(web_group_experiment, 'completion', 'one-sided z-test'))]
+
+
+def benchmark_scaling(n_clients_options=(10_000, 100_000, 1_000_000), repeat=1, seed=0):
+    # This function records the runtime and the peak memory of every function in backend.py on synthetic data of growing size, so
+    # regressions and scaling limits are visible. Sizes that need more memory than the machine has should use DuckDBBackend instead,
+    # with the Parquet files of synthetic.write_data().
+    # The figures of statistic_func() are drawn with the non-interactive 'Agg' backend set at the top of this file, and closed after each call.
+
+    # Parameters
+    # n_clients_options = numbers of clients to simulate. There are about 7 events per client.
+    # repeat = how many times each function is timed.
+    # seed = seed of the synthetic data.
+
+    results = []
+
+    for n_clients in n_clients_options:
+        client_profiles, experiment_roster, web_group = generate_data(n_clients, seed=seed)
+
+        for name, call in backend_calls(client_profiles, experiment_roster, web_group):
+            seconds, peak_bytes = measure_call(call, repeat=repeat)
+            results.append({'n_clients': n_clients, 'n_events': len(web_group), 'function': name, 'seconds': seconds,
+                            'peak_mb': peak_bytes / 2 ** 20, 'events_per_second': len(web_group) / seconds})
+
+    return pd.DataFrame(results)
+
+
+def benchmark_sharding(n_clients=1_000_000, n_jobs_options=(1, 2, 4, None), repeat=1, seed=0):
+    # This function measures the throughput (events per second) of calculate_avg_time_per_step(), error_rate() and drop_off_rate() in
+    # backend.py against the sharded engine with a growing number of worker processes.
+
+    # Parameters
+    # n_clients = number of clients of the synthetic data. There are about 7 events per client.
+    # n_jobs_options = numbers of worker processes to compare. None uses every CPU.
+    # repeat = how many times each run is timed.
+    # seed = seed of the synthetic data.
+
+    client_profiles, experiment_roster, web_group = generate_data(n_clients, seed=seed)
+    web_group_experiment = data_wrangling(web_group, experiment_roster, client_profiles)[4]
+
+    def backend_functions():
+        calculate_avg_time_per_step(web_group_experiment)
+        error_rate(web_group_experiment)
+        drop_off_rate(web_group_experiment)
+
+    def sharded(n_jobs):
+        metrics = sharded_funnel_metrics(web_group_experiment, n_jobs=n_jobs)
+        metrics.avg_time_per_step()
+        metrics.error_rate()
+        metrics.drop_off_rate()
+
+    results = [{'engine': 'backend functions', 'n_jobs': 1, 'seconds': time_call(backend_functions, repeat=repeat)}]
+    for n_jobs in n_jobs_options:
+        results.append({'engine': 'sharded', 'n_jobs': n_jobs or os.cpu_count(), 'seconds': time_call(sharded, n_jobs, repeat=repeat)})
+
+    results = pd.DataFrame(results)
+    results['events_per_second'] = len(web_group_experiment) / results['seconds']
+
+    return results
+
+
+if __name__ == '__main__':
+    # Usage: python benchmark.py [data_dir]
+    # Benchmarks the cold and warm loads of the raw CSVs in data_dir (default data/raw). If the folder doesn't have every raw file,
+    # the benchmark runs on simulated CSVs of 100,000 clients written to a temporary folder instead.
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data/raw'
+
+    if all(os.path.exists(os.path.join(data_dir, file_name)) for file_name in RAW_FILES.values()):
+        print(benchmark_load_data(data_dir))
+    else:
+        synthetic_dir = tempfile.mkdtemp()
+        try:
+            print(f"{data_dir} doesn't have every raw file, benchmarking simulated CSVs of 100,000 clients.")
+            print(benchmark_load_data(write_raw_data(synthetic_dir, 100_000)))
+        finally:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
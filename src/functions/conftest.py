@@ -0,0 +1,25 @@
+import pytest
+from synthetic import generate_data
+
+
+# Fixtures shared by the regression checks against the functions in backend.py, which are the reference.
+
+# Variations every metric is checked for. None gives the overall numbers.
+VARIATIONS = ['Control', 'Test', None]
+
+
+@pytest.fixture(scope='session')
+def frames():
+    # Synthetic client_profiles, experiment_roster and web_group of 3000 clients, like load_data() returns.
+
+    return generate_data(3000, 1_000_000, seed=7)
+
+
+@pytest.fixture(scope='session')
+def web_data(frames):
+    # The web data with the variation of each client, like web_group_experiment. Shared by every test, so don't change it in place.
+
+    client_profiles, experiment_roster, web_group = frames
+    web_data = web_group.merge(experiment_roster, on='client_id')
+
+    return web_data[web_data['Variation'].notna()].reset_index(drop=True)
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+from loader import PROCESS_DICT
+
+
+# Step count columns of final_rooster_process_counts_profile, in funnel order.
+STEP_COLUMNS = list(PROCESS_DICT)
+
+# Segment dimensions of the cube and how each one is built from the client profile. Bins are (lower, upper], as in pd.cut.
+AGE_BINS = [float('-inf'), 30, 40, 50, 60, float('inf')]
+AGE_LABELS = ['<=30', '31-40', '41-50', '51-60', '>60']
+
+TENURE_BINS = [float('-inf'), 5, 10, 20, float('inf')]
+TENURE_LABELS = ['<=5 years', '6-10 years', '11-20 years', '>20 years']
+
+LOGIN_BINS = [float('-inf'), 4, 7, float('inf')]
+LOGIN_LABELS = ['Low Activity', 'Medium Activity', 'High Activity']
+
+DIMENSIONS = ['Variation', 'age_band', 'tenure_band', 'gendr', 'balance_category', 'login_activity']
+
+
+def client_error_counts(data):
+    # This function counts, for each client, the events and the backward steps (errors, as in error_rate()).
+    # It's the only pass over the event log. Its result can be given to SegmentCube so the cube also has error rates.
+
+    # Parameters
+    # data = dataset which must contain client_id, process_step and date_time, like web_group_experiment.
+
+    error_df = data.sort_values(by=['client_id', 'date_time'])
+    error_mask = error_df.groupby('client_id')['process_step'].shift(1) > error_df['process_step']
+
+    return pd.DataFrame({'events': error_df.groupby('client_id').size(), 'errors': error_mask.groupby(error_df['client_id']).sum()})
+
+
+class SegmentCube:
+    # This class is a precomputed cube of funnel counts by variation and segment (age band, tenure band, gender, balance category and login
+    # activity), built from final_rooster_process_counts_profile. Every cell only holds additive counts:
+    #   - clients: number of clients.
+    #   - reached_<step>: clients that were at the step at least once.
+    #   - visits_<step>: total number of times clients were at the step.
+    #   - events and errors: events and backward steps, if the per-client errors were given (see client_error_counts()).
+    # Any roll-up or slice is a sum of cells, so query() answers from the cube without going back to the clients or the event log.
+    # New or changed clients are added with update(), which only touches the cells of those clients.
+
+    def __init__(self, profile, client_errors=None, balance_threshold=None):
+        # Parameters
+        # profile = dataset with one row per client, like final_rooster_process_counts_profile.
+        # client_errors = per-client events and errors returned by client_error_counts(). Default is None which leaves error rates out.
+        # balance_threshold = balance that splits Low and High Balance. Default is None which uses the median balance of profile, as the
+        #                     chi-test in statistic_func() does. It stays fixed afterwards so updates put clients in the same segments.
+
+        if balance_threshold is None:
+            balance_threshold = profile['bal'].median()
+
+        self.balance_threshold = balance_threshold
+        self.has_errors = client_errors is not None
+        self.cells = self.client_cells(profile, client_errors)
+
+    def segments(self, profile):
+        # Returns the segment of every client, one column per dimension. Missing values go to an 'Unknown' segment.
+
+        segments = pd.DataFrame({'Variation': profile['Variation'].astype(str),
+                                 'age_band': pd.cut(profile['clnt_age'], AGE_BINS, labels=AGE_LABELS),
+                                 'tenure_band': pd.cut(profile['clnt_tenure_yr'], TENURE_BINS, labels=TENURE_LABELS),
+                                 'gendr': profile['gendr'],
+                                 'balance_category': pd.cut(profile['bal'], [float('-inf'), self.balance_threshold, float('inf')],
+                                                            labels=['Low Balance', 'High Balance']),
+                                 'login_activity': pd.cut(profile['logons_6_mnth'], LOGIN_BINS, labels=LOGIN_LABELS)},
+                                index=profile.index)
+
+        return segments.astype(object).fillna('Unknown').astype(str)
+
+    def client_cells(self, profile, client_errors=None, sign=1):
+        # Groups clients into cells and sums their counts. sign=-1 gives the counts to subtract clients from the cube.
+
+        measures = pd.DataFrame({'clients': 1}, index=profile.index)
+        for step in STEP_COLUMNS:
+            measures[f'reached_{step}'] = (profile[step] > 0).astype('int64')
+            measures[f'visits_{step}'] = profile[step].astype('int64')
+
+        if self.has_errors:
+            errors = client_errors.reindex(profile['client_id']).fillna(0)
+            measures['events'] = errors['events'].to_numpy().astype('int64')
+            measures['errors'] = errors['errors'].to_numpy().astype('int64')
+
+        cells = pd.concat([self.segments(profile), measures * sign], axis=1).groupby(DIMENSIONS).sum()
+
+        return cells
+
+    def update(self, new_profile, old_profile=None, client_errors=None, old_client_errors=None):
+        # This method updates the cube incrementally. The old rows of changed clients are subtracted and the new rows are added.
+
+        # Parameters
+        # new_profile = rows of new or changed clients.
+        # old_profile = previous rows of the changed clients. Default is None for clients that are new.
+        # client_errors, old_client_errors = per-client events and errors of the new and old rows, if the cube has error rates.
+
+        changes = [self.client_cells(new_profile, client_errors)]
+        if old_profile is not None:
+            changes.append(self.client_cells(old_profile, old_client_errors, sign=-1))
+
+        cells = self.cells
+        for change in changes:
+            cells = cells.add(change, fill_value=0)
+
+        # Drops the cells that no longer have clients.
+        self.cells = cells[cells['clients'] > 0].astype('int64')
+
+        return self
+
+    def query(self, by=('Variation',), where=None):
+        # This method rolls the cube up to the dimensions in by, after keeping only the segments in where, and returns the funnel rates.
+
+        # Parameters
+        # by = dimensions to group by. See DIMENSIONS.
+        # where = dictionary of dimension -> segment or list of segments to keep, for example {'gendr': 'F', 'age_band': ['<=30', '31-40']}.
+
+        cells = self.cells
+
+        for dimension, segments in (where or {}).items():
+            if isinstance(segments, str):
+                segments = [segments]
+            cells = cells[cells.index.get_level_values(dimension).isin(segments)]
+
+        counts = cells.groupby(level=list(by)).sum() if by else cells.sum().to_frame('All').T
+
+        return self.rates(counts)
+
+    def rates(self, counts):
+        # Derives completion, drop-off and error rates (percentages) from summed counts.
+
+        results = counts[['clients']].copy()
+        results['completion_rate'] = counts[f'reached_{STEP_COLUMNS[-1]}'] / counts['clients'] * 100
+
+        for step, next_step in zip(STEP_COLUMNS[:-1], STEP_COLUMNS[1:]):
+            reached = counts[f'reached_{step}']
+            results[f'dropoff_rate_{step}'] = (reached - counts[f'reached_{next_step}']) / reached.replace(0, np.nan) * 100
+
+        if self.has_errors:
+            results['error_rate'] = counts['errors'] / counts['events'] * 100
+
+        return results
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from loader import PROCESS_DICT, STEP_NAMES
+
+
+# Pre-experiment covariates of the client profile. They were measured before the experiment, so the variation can't change them.
+COVARIATES = ['logons_6_mnth', 'calls_6_mnth', 'bal', 'clnt_tenure_mnth']
+
+
+def client_outcomes(data, client_profiles, covariates=COVARIATES, segments=()):
+    # This function builds one row per client with its variation, segments, covariates and outcomes:
+    #   - completion: 1 if the client got to the last step ('confirm'), 0 if not, as in calculate_completion_rate().
+    #   - time_<step>: mean seconds the client took to get to the step, with the events sorted by client_id and date_time as in
+    #                  calculate_avg_time_per_step(). NaN if the client never got to the step.
+    # The client is the unit that was randomized, so the tests are done on client level outcomes.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step and date_time, like web_group_experiment.
+    # client_profiles = one row per client with client_id and the covariates, like client_profiles from load_data().
+    # covariates = columns of client_profiles used to adjust the outcomes. Missing values are filled with the mean of the column, which
+    #              is fine because the covariates don't depend on the variation.
+    # segments = columns of client_profiles to split the results by, for example ['gendr'].
+
+    events = data.sort_values(by=['client_id', 'date_time'])
+    seconds = events.groupby('client_id')['date_time'].diff().dt.total_seconds()
+
+    clients = events.groupby('client_id')[['Variation']].first()
+    clients['completion'] = (events['process_step'] == PROCESS_DICT['confirm']).groupby(events['client_id']).any().astype('float64')
+
+    # Excludes 'start' (step 0), as calculate_avg_time_per_step() does.
+    step_times = seconds[events['process_step'] != 0].groupby([events['client_id'], events['process_step']]).mean().unstack()
+    step_times.columns = [f"time_{STEP_NAMES.get(step, step)}" for step in step_times.columns]
+    clients = clients.join(step_times)
+
+    profiles = client_profiles.set_index('client_id')[list(covariates) + list(segments)]
+    clients = clients.join(profiles, how='left')
+    clients[list(covariates)] = clients[list(covariates)].fillna(clients[list(covariates)].mean())
+
+    for segment in segments:
+        clients[segment] = clients[segment].astype(object).fillna('Unknown').astype(str)
+
+    return clients.reset_index()
+
+
+def moment_matrices(cell_codes, n_cells, values):
+    # This function returns, for every cell, the matrix of sums of products of the columns of values: sum(z z^T) over the rows of the
+    # cell. With a first column of ones it holds the count, the sums and the cross products of every column, which is all a regression
+    # needs. Each entry of the upper triangle is one np.bincount over the rows.
+
+    # Parameters
+    # cell_codes = int array with the cell of each row, from 0 to n_cells - 1.
+    # n_cells = number of cells.
+    # values = (rows, columns) array.
+
+    n_columns = values.shape[1]
+    moments = np.zeros((n_cells, n_columns, n_columns))
+
+    for row in range(n_columns):
+        for column in range(row, n_columns):
+            moments[:, row, column] = np.bincount(cell_codes, weights=values[:, row] * values[:, column], minlength=n_cells)
+            moments[:, column, row] = moments[:, row, column]
+
+    return moments
+
+
+def cuped_lifts(clients, metrics=None, covariates=COVARIATES, by=(), control='Control', confidence=0.95):
+    # This function estimates the lift of every arm against the control arm, for every metric and segment, with and without CUPED
+    # (regression adjustment on the pre-experiment covariates). Outcomes are adjusted as y - (x - mean x) theta, where theta is the
+    # regression of the outcome on the covariates with all arms of the segment pooled. The adjusted lift has the same expected value as the
+    # plain lift, but a lower variance when the covariates explain part of the outcome, so decisions need less data.
+    # Everything is computed from per-cell moment matrices (cell = segment x arm x metric) in one pass, then with batched linear algebra.
+    # Returns one row per segment, arm and metric with the plain and adjusted lifts, their confidence intervals and p-values, and the
+    # variance reduction (1 - adjusted variance / plain variance of the lift).
+
+    # Parameters
+    # clients = one row per client, as returned by client_outcomes().
+    # metrics = outcome columns to test. Default is None which uses completion and every time_<step> column.
+    # covariates = columns used to adjust the outcomes.
+    # by = segment columns. Results are given for every segment and for 'All'.
+    # control = name of the control arm.
+    # confidence = confidence level of the intervals. The most common value is 0.95.
+
+    if metrics is None:
+        metrics = ['completion'] + [column for column in clients.columns if column.startswith('time_')]
+
+    by = list(by)
+    n_covariates = len(covariates)
+
+    # Stacks the metrics: one row per client and metric with an outcome.
+    outcomes = clients[metrics].to_numpy(dtype='float64')
+    client_rows, metric_codes = np.nonzero(~np.isnan(outcomes))
+
+    if by:
+        segment_codes, segment_keys = pd.MultiIndex.from_frame(clients[by].astype(str)).factorize(sort=True)
+        segments = [' | '.join(key) for key in segment_keys]
+    else:
+        segment_codes, segments = np.zeros(len(clients), dtype='int64'), ['All']
+    arm_codes, arms = pd.factorize(clients['Variation'].astype(str), sort=True)
+    arms = list(arms)
+
+    n_segments, n_arms, n_metrics = len(segments), len(arms), len(metrics)
+    cell_codes = (segment_codes[client_rows] * n_arms + arm_codes[client_rows]) * n_metrics + metric_codes
+
+    # z = [1, covariates, outcome] for every row.
+    values = np.column_stack([np.ones(len(client_rows)), clients[covariates].to_numpy(dtype='float64')[client_rows],
+                              outcomes[client_rows, metric_codes]])
+    moments = moment_matrices(cell_codes, n_segments * n_arms * n_metrics, values).reshape(n_segments, n_arms, n_metrics,
+                                                                                            n_covariates + 2, n_covariates + 2)
+
+    # The 'All' segment is the sum of the segments, the moments are additive.
+    if by:
+        moments = np.concatenate([moments, moments.sum(axis=0, keepdims=True)])
+        segments.append('All')
+
+    n = moments[..., 0, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = moments[..., 0, :] / n[..., None]
+        covariance = (moments - n[..., None, None] * means[..., :, None] * means[..., None, :]) / (n[..., None, None] - 1)
+
+    # theta of every segment and metric, from the covariances with all arms pooled.
+    pooled = moments.sum(axis=1)
+    pooled_n = pooled[..., 0, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled_means = pooled[..., 0, :] / pooled_n[..., None]
+        pooled_covariance = pooled[..., 1:, 1:] / pooled_n[..., None, None] - pooled_means[..., 1:, None] * pooled_means[..., None, 1:]
+    theta = np.einsum('...ij,...j->...i', np.linalg.pinv(np.nan_to_num(pooled_covariance[..., :-1, :-1])),
+                      np.nan_to_num(pooled_covariance[..., :-1, -1]))
+
+    # Plain and adjusted mean and variance of every cell.
+    outcome_mean = means[..., -1]
+    outcome_variance = covariance[..., -1, -1]
+    covariate_shift = means[..., 1:-1] - pooled_means[:, None, :, 1:-1]
+    cell_theta = theta[:, None, :, :]
+    adjusted_mean = outcome_mean - np.einsum('...i,...i->...', covariate_shift, cell_theta)
+    adjusted_variance = (outcome_variance - 2 * np.einsum('...i,...i->...', cell_theta, covariance[..., 1:-1, -1])
+                         + np.einsum('...i,...ij,...j->...', cell_theta, covariance[..., 1:-1, 1:-1], cell_theta))
+
+    # Every arm against the control arm.
+    control_arm = arms.index(control)
+    test_arms = [arm for arm in range(n_arms) if arm != control_arm]
+    z = norm.ppf((1 + confidence) / 2)
+
+    def lift(mean, variance):
+        difference = mean[:, test_arms] - mean[:, [control_arm]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            standard_error = np.sqrt(variance[:, test_arms] / n[:, test_arms] + variance[:, [control_arm]] / n[:, [control_arm]])
+            p_value = 2 * norm.sf(np.abs(difference / standard_error))
+        return difference, standard_error, p_value
+
+    plain_lift, plain_se, plain_p = lift(outcome_mean, outcome_variance)
+    adjusted_lift, adjusted_se, adjusted_p = lift(adjusted_mean, adjusted_variance)
+
+    segment_index, arm_index, metric_index = np.indices(plain_lift.shape)
+    arm_names = np.array(arms)[test_arms]
+
+    results = pd.DataFrame({'segment': np.array(segments, dtype=object)[segment_index.ravel()],
+                            'arm': arm_names[arm_index.ravel()],
+                            'control': control,
+                            'metric': np.array(metrics, dtype=object)[metric_index.ravel()],
+                            'n_arm': n[:, test_arms][segment_index, arm_index, metric_index].ravel().astype('int64'),
+                            'n_control': n[:, [control_arm]][segment_index, 0, metric_index].ravel().astype('int64'),
+                            'control_mean': outcome_mean[:, [control_arm]][segment_index, 0, metric_index].ravel(),
+                            'arm_mean': outcome_mean[:, test_arms][segment_index, arm_index, metric_index].ravel(),
+                            'lift': plain_lift.ravel(),
+                            'ci_low': (plain_lift - z * plain_se).ravel(),
+                            'ci_high': (plain_lift + z * plain_se).ravel(),
+                            'p_value': plain_p.ravel(),
+                            'adjusted_lift': adjusted_lift.ravel(),
+                            'adjusted_ci_low': (adjusted_lift - z * adjusted_se).ravel(),
+                            'adjusted_ci_high': (adjusted_lift + z * adjusted_se).ravel(),
+                            'adjusted_p_value': adjusted_p.ravel()})
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['variance_reduction'] = (1 - (adjusted_se / plain_se) ** 2).ravel()
+
+    return results
+
+
+def cuped_analysis(data, client_profiles, covariates=COVARIATES, by=(), control='Control', confidence=0.95):
+    # This function runs the CUPED tests of the completion rate and of the time to get to every step, from the data of data_wrangling().
+    # It is the variance-reduced version of the two-proportion z-test and the step time tests: the lifts are the same on average, with
+    # narrower confidence intervals. Completion lifts are shares (0.03 is 3 percentage points) and time lifts are in seconds.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step and date_time, like web_group_experiment.
+    # client_profiles = one row per client with client_id and the covariates.
+    # covariates, by, control, confidence = see cuped_lifts().
+
+    clients = client_outcomes(data, client_profiles, covariates, by)
+
+    return cuped_lifts(clients, covariates=covariates, by=by, control=control, confidence=confidence)
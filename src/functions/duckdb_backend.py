@@ -0,0 +1,358 @@
+import os
+import duckdb
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import backend
+from loader import STEP_NAMES
+from funnel import dropoff_from_counts
+
+
+# Columns the metric functions read from web_group_experiment.
+METRIC_COLUMNS = ['client_id', 'Variation', 'process_step', 'date_time']
+
+
+def parquet_paths(source):
+    # Returns the list of Parquet files of a source, or None if the source is a dataframe.
+
+    if isinstance(source, str):
+        return [source]
+    if isinstance(source, (list, tuple)):
+        return list(source)
+
+    return None
+
+
+def empty_frame(source):
+    # Returns a frame with no rows and the columns and types of a source, as pandas would read it.
+    # Categories can't be known from the schema alone, so categorical columns are read (they are dictionary encoded, so this is cheap).
+
+    paths = parquet_paths(source)
+    if paths is None:
+        return source.iloc[:0]
+
+    frame = pq.read_schema(paths[0]).empty_table().to_pandas()
+
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            values = pd.concat([pd.read_parquet(path, columns=[column])[column] for path in paths])
+            frame[column] = frame[column].astype(values.dtype)
+
+    return frame
+
+
+def restore_types(result, schema):
+    # Casts the columns of a query result back to the pandas types of the same columns in schema, and turns SQL NULLs into NaN as pandas
+    # does in merges. Columns that aren't in schema are left as they are.
+
+    for column in result.columns:
+        if column not in schema.columns:
+            continue
+
+        dtype = schema[column].dtype
+        if dtype == object:
+            result[column] = result[column].astype(object).where(result[column].notna(), np.nan)
+        elif result[column].dtype != dtype:
+            result[column] = result[column].astype(dtype)
+
+    return result
+
+
+class DuckDBBackend:
+    # This class runs the wrangling and the metric functions of backend.py as SQL queries with an embedded DuckDB engine, instead of in
+    # pandas memory. Queries are multi-threaded, read Parquet files lazily (only the columns they need) and spill to disk when they need
+    # more memory than memory_limit. The outputs are the same as the ones of backend.py.
+    #
+    # It has the same functions as backend.py, so either can be used as the execution backend:
+    #   engine = backend                              # pandas, in memory.
+    #   engine = DuckDBBackend(memory_limit='4GB')    # DuckDB, out of core.
+    #   client_process_counts, ... = engine.data_wrangling(web_group, experiment_roster, client_profiles)
+    #   engine.error_rate(web_group_experiment, 'Test')
+    #   engine.close()                                # or use it in a with block.
+    #
+    # Every function takes dataframes or paths to Parquet files (a path or a list of paths, read in order, like the cache of loader.py).
+    # write_wrangling() writes the large event level outputs of data_wrangling() to Parquet without ever loading them in pandas, and the
+    # metric functions can read those files directly.
+
+    def __init__(self, memory_limit=None, temp_directory=None, threads=None, database=':memory:'):
+        # Parameters
+        # memory_limit = maximum memory DuckDB uses before spilling to disk, for example '4GB'. Default is None which is DuckDB's default (80% of RAM).
+        # temp_directory = folder where DuckDB spills to disk. Default is None which makes a new folder in the system temporary directory,
+        #                  so nothing is written under the working directory.
+        # threads = number of threads. Default is None which uses every CPU.
+        # database = DuckDB database file. Default is ':memory:'.
+
+        # A folder made here is deleted by close(). A folder given by the caller is kept.
+        self.owns_temp_directory = temp_directory is None
+        if temp_directory is None:
+            temp_directory = tempfile.mkdtemp(prefix='duckdb_')
+        else:
+            os.makedirs(temp_directory, exist_ok=True)
+        self.temp_directory = temp_directory
+
+        self.connection = duckdb.connect(database)
+        self.connection.execute(f"SET temp_directory = '{temp_directory}'")
+        # Results are always ordered explicitly, so DuckDB doesn't need to keep the order of the rows, which uses less memory.
+        self.connection.execute("SET preserve_insertion_order = false")
+
+        if memory_limit is not None:
+            self.connection.execute(f"SET memory_limit = '{memory_limit}'")
+        if threads is not None:
+            self.connection.execute(f"SET threads = {int(threads)}")
+
+        self.views = 0
+
+    def close(self):
+        # This method closes the DuckDB connection and deletes the spill folder if this instance made it. Calling it again does nothing.
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+        if self.owns_temp_directory:
+            shutil.rmtree(self.temp_directory, ignore_errors=True)
+            self.owns_temp_directory = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def view(self, source, columns=None):
+        # This method makes a source available to the queries as a view and returns its name. The view has a row_order column with the
+        # position of each row in the source, so ties are broken the way pandas' stable sorts and merges break them.
+        # columns = columns to keep. Default is None which keeps them all.
+
+        self.views += 1
+        name = f"source_{self.views}"
+        paths = parquet_paths(source)
+
+        if paths is None:
+            if columns is not None:
+                source = source[list(columns)]
+            self.connection.register(f"{name}_frame", source.assign(row_order=np.arange(len(source), dtype='int64')))
+            self.connection.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT * FROM {name}_frame")
+        else:
+            # Rows of each file are numbered in the file, and files keep the order of the list.
+            select = '* EXCLUDE (file_row_number)' if columns is None else ', '.join(f'"{column}"' for column in columns)
+            scans = [f"SELECT {select}, ({index}::BIGINT << 40) + file_row_number AS row_order "
+                     f"FROM read_parquet('{path}', file_row_number = true)" for index, path in enumerate(paths)]
+            self.connection.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS {' UNION ALL '.join(scans)}")
+
+        return name
+
+    def drop(self, *names):
+        # Drops the views made by view().
+
+        for name in names:
+            self.connection.execute(f"DROP VIEW IF EXISTS {name}")
+            try:
+                self.connection.unregister(f"{name}_frame")
+            except duckdb.Error:
+                pass
+
+    def columns(self, name):
+        # Returns the columns of a view, without row_order.
+
+        return [column for column in self.connection.execute(f"SELECT * FROM {name} LIMIT 0").df().columns if column != 'row_order']
+
+    def wrangling_queries(self, web_group, experiment_roster, client_profiles):
+        # Returns the SQL of every output of data_wrangling(), and the step columns of client_process_counts.
+
+        web_columns = self.columns(web_group)
+        roster_columns = [column for column in self.columns(experiment_roster) if column != 'client_id']
+        profile_columns = [column for column in self.columns(client_profiles) if column != 'client_id']
+
+        steps = [row[0] for row in self.connection.execute(f"SELECT DISTINCT process_step FROM {web_group} ORDER BY 1").fetchall()]
+        step_columns = [STEP_NAMES.get(step, step) for step in steps]
+
+        counts = ', '.join(f"count(*) FILTER (WHERE process_step = {step}) AS \"{column}\"" for step, column in zip(steps, step_columns))
+        client_process_counts = f"SELECT client_id, {counts} FROM {web_group} GROUP BY client_id"
+
+        roster_select = ', '.join(f'r."{column}"' for column in roster_columns)
+        profile_select = ', '.join(f'p."{column}"' for column in profile_columns)
+        step_select = ', '.join(f'c."{column}"' for column in step_columns)
+
+        # Inner merges keep the order of the left rows, then of the right rows, as pd.merge does.
+        final_rooster_process_counts_profile = (f"SELECT c.client_id, {step_select}, {roster_select}, {profile_select} "
+                                                f"FROM ({client_process_counts}) c "
+                                                f"JOIN {experiment_roster} r ON c.client_id = r.client_id "
+                                                f"JOIN {client_profiles} p ON c.client_id = p.client_id "
+                                                f"ORDER BY c.client_id, r.row_order, p.row_order")
+
+        web_select = ', '.join(f'w."{column}"' for column in web_columns)
+        web_group_experiment = (f"SELECT {web_select}, {roster_select}, w.row_order AS web_row_order, r.row_order AS roster_row_order "
+                                f"FROM {web_group} w JOIN {experiment_roster} r ON w.client_id = r.client_id")
+
+        client_profile_experiment = (f"SELECT e.* EXCLUDE (web_row_order, roster_row_order), {profile_select} "
+                                     f"FROM ({web_group_experiment}) e LEFT JOIN {client_profiles} p ON e.client_id = p.client_id "
+                                     f"ORDER BY e.web_row_order, e.roster_row_order, p.row_order")
+
+        web_group_experiment = (f"SELECT * EXCLUDE (web_row_order, roster_row_order) FROM ({web_group_experiment}) "
+                                f"ORDER BY web_row_order, roster_row_order")
+
+        return {'client_process_counts': client_process_counts + ' ORDER BY client_id',
+                'final_rooster_process_counts_profile': final_rooster_process_counts_profile,
+                'web_group_experiment': web_group_experiment,
+                'client_profile_experiment': client_profile_experiment}, step_columns
+
+    def data_wrangling(self, web_group, experiment_roster, client_profiles):
+        # This method returns the same six dataframes as data_wrangling() in backend.py, computed by DuckDB.
+
+        # Parameters
+        # web_group, experiment_roster, client_profiles = dataframes or Parquet files, as returned by load_data() or cached by loader.py.
+
+        views = [self.view(source) for source in [web_group, experiment_roster, client_profiles]]
+
+        try:
+            queries, step_columns = self.wrangling_queries(*views)
+            results = {name: self.connection.execute(query).df() for name, query in queries.items()}
+        finally:
+            self.drop(*views)
+
+        # Column types of the pandas outputs, from data_wrangling() in backend.py run on the empty inputs.
+        schemas = backend.data_wrangling(*[empty_frame(source) for source in [web_group, experiment_roster, client_profiles]])
+        step_types = {column: 'int64' for column in step_columns}
+
+        client_process_counts = results['client_process_counts'].astype(step_types).set_index('client_id')
+        client_process_counts.columns = pd.Index(step_columns, name=schemas[0].columns.name)
+
+        final_rooster_process_counts_profile = restore_types(results['final_rooster_process_counts_profile'].astype(step_types), schemas[1])
+        web_group_experiment = restore_types(results['web_group_experiment'], schemas[4])
+        client_profile_experiment = restore_types(results['client_profile_experiment'], schemas[5])
+
+        # The variation splits keep the index of final_rooster_process_counts_profile, as in backend.py.
+        control_profile_df = final_rooster_process_counts_profile[final_rooster_process_counts_profile['Variation'] == 'Control']
+        test_profile_df = final_rooster_process_counts_profile[final_rooster_process_counts_profile['Variation'] == 'Test']
+
+        return client_process_counts, final_rooster_process_counts_profile, control_profile_df, test_profile_df, web_group_experiment, client_profile_experiment
+
+    def write_wrangling(self, web_group, experiment_roster, client_profiles, output_dir):
+        # This method writes the outputs of data_wrangling() to Parquet files with DuckDB, so the event level outputs never have to fit in
+        # memory. Returns a dictionary of output name -> path. The control and test splits are left out, they are filters of
+        # final_rooster_process_counts_profile.
+
+        # Parameters
+        # web_group, experiment_roster, client_profiles = dataframes or Parquet files.
+        # output_dir = folder where the Parquet files are written.
+
+        os.makedirs(output_dir, exist_ok=True)
+        views = [self.view(source) for source in [web_group, experiment_roster, client_profiles]]
+        paths = {}
+
+        try:
+            queries, _ = self.wrangling_queries(*views)
+            for name, query in queries.items():
+                paths[name] = os.path.join(output_dir, f"{name}.parquet")
+                self.connection.execute(f"COPY ({query}) TO '{paths[name]}' (FORMAT PARQUET)")
+        finally:
+            self.drop(*views)
+
+        return paths
+
+    def query_variation(self, data, variation, allowed=('Test', 'Control')):
+        # Returns the view of data and the SQL filter of a variation, as the backend functions select it.
+
+        name = self.view(data, METRIC_COLUMNS)
+        where = f"WHERE Variation = '{variation}'" if variation in allowed else ''
+
+        return name, where
+
+    def calculate_completion_rate(self, data, variation=None):
+        # Same as calculate_completion_rate() in backend.py.
+
+        name, where = self.query_variation(data, variation)
+        try:
+            confirm_step_users, total_users = self.connection.execute(
+                f"SELECT count(DISTINCT client_id) FILTER (WHERE process_step = 4), count(DISTINCT client_id) FROM {name} {where}").fetchone()
+        finally:
+            self.drop(name)
+
+        return (confirm_step_users / total_users) * 100
+
+    def step_events(self, name):
+        # Returns the SQL that orders the events of each client by date_time, as backend.py sorts them, with the previous step and time.
+
+        window = "OVER (PARTITION BY client_id ORDER BY date_time, row_order)"
+        return (f"SELECT *, lag(process_step) {window} AS previous_step, "
+                f"epoch_ns(date_time) - epoch_ns(lag(date_time) {window}) AS time_diff FROM {name}")
+
+    def calculate_avg_time_per_step(self, data, variation=None):
+        # Same as calculate_avg_time_per_step() in backend.py. The differences are summed in nanoseconds and divided as floats, and the
+        # mean is truncated to whole nanoseconds, as pandas does.
+
+        # Time differences have the same unit as date_time.
+        unit = np.datetime_data(empty_frame(data)['date_time'].dtype)[0]
+
+        name = self.view(data, METRIC_COLUMNS)
+        try:
+            sums = self.connection.execute(
+                f"SELECT Variation, process_step, sum(time_diff)::DOUBLE AS time_sum, count(time_diff) AS time_count "
+                f"FROM ({self.step_events(name)}) WHERE process_step != 0 "
+                f"GROUP BY GROUPING SETS ((Variation, process_step), (process_step))").df()
+        finally:
+            self.drop(name)
+
+        def average(rows):
+            rows = rows.sort_values('process_step')
+            nanoseconds = (rows['time_sum'] / rows['time_count']).where(rows['time_count'] > 0)
+            steps = rows['process_step'].astype('int64').map(lambda step: STEP_NAMES.get(step, step))
+            time_diff = pd.to_timedelta(np.trunc(nanoseconds.to_numpy()), unit='ns').astype(f'timedelta64[{unit}]')
+            return pd.Series(time_diff, index=pd.Index(steps.to_numpy(), name='process_step'), name='time_diff')
+
+        overall = sums[sums['Variation'].isna()]
+        by_variation = sums[sums['Variation'].notna()]
+        average_time_per_step_control = average(by_variation[by_variation['Variation'] == 'Control'])
+        average_time_per_step_test = average(by_variation[by_variation['Variation'] == 'Test'])
+        avg_time_per_step = average(overall)
+
+        if variation == 'Control':
+            return average_time_per_step_control
+        elif variation == 'Test':
+            return average_time_per_step_test
+        elif variation == 'Overall':
+            return avg_time_per_step
+
+        return average_time_per_step_control, average_time_per_step_test, avg_time_per_step
+
+    def error_rate(self, data, variation=None):
+        # Same as error_rate() in backend.py.
+
+        name, where = self.query_variation(data, variation)
+        try:
+            errors = self.connection.execute(
+                f"SELECT process_step, count(*) AS steps, count(*) FILTER (WHERE previous_step > process_step) AS errors "
+                f"FROM ({self.step_events(name)} {where}) GROUP BY process_step ORDER BY process_step").df()
+        finally:
+            self.drop(name)
+
+        total_errors = np.int64(errors['errors'].sum())
+        total_steps = int(errors['steps'].sum())
+        error_rate = total_errors / total_steps * 100
+
+        step_type = empty_frame(data)['process_step'].dtype
+        average_error_per_step = pd.Series((errors['errors'] / errors['steps'] * 100).to_numpy(),
+                                           index=pd.Index(errors['process_step'].astype(step_type).to_numpy(), name='process_step'),
+                                           name='process_step')
+
+        return total_errors, total_steps, error_rate, average_error_per_step
+
+    def drop_off_rate(self, data, variation=None):
+        # Same as drop_off_rate() in backend.py.
+
+        name, where = self.query_variation(data, variation)
+        try:
+            clients_at_step = self.connection.execute(
+                f"SELECT process_step, count(DISTINCT client_id) AS clients FROM {name} {where} GROUP BY process_step").df()
+        finally:
+            self.drop(name)
+
+        clients_at_step = clients_at_step.set_index('process_step')['clients']
+        clients_at_step = clients_at_step.reindex(range(int(clients_at_step.index.max()) + 1), fill_value=0)
+
+        dropoff_rate = dropoff_from_counts(clients_at_step.to_frame().T).iloc[0]
+
+        return pd.DataFrame({'process_step': dropoff_rate.index.to_numpy(), 'dropoff_rate': dropoff_rate.to_numpy()})
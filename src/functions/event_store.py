@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+
+class EventStore:
+    # This class is a compact version of web_group_experiment and client_profile_experiment from data_wrangling().
+    # client_profile_experiment copies every demographic column onto every event. Here the events only keep small numerical columns:
+    #   - client_code: int32 position of the client in the client table (client_id factorized).
+    #   - process_step: int8.
+    #   - date_time: int64 seconds since 1970-01-01.
+    #   - visit_code: int32 code of the visit_id, if the web data has it. -1 if the visit_id is missing.
+    # Variation and the demographics are stored once per client in the client table and only joined to the events when asked for,
+    # by looking up the client codes.
+
+    def __init__(self, events, clients, visit_ids=None):
+        # Parameters
+        # events = dataframe with client_code, process_step, date_time (epoch seconds) and optionally visit_code.
+        # clients = dataframe indexed by client_code with client_id, Variation and the demographic columns.
+        # visit_ids = array with the visit_id of each visit_code.
+
+        self.events = events
+        self.clients = clients
+        self.visit_ids = visit_ids
+
+    @classmethod
+    def from_frames(cls, web_group, experiment_roster, client_profiles):
+        # This method builds the store from the dataframes returned by load_data(). Like data_wrangling(), only clients in the experiment are kept.
+
+        # Parameters
+        # web_group = web data with client_id, process_step (numerical) and date_time.
+        # experiment_roster = dataset with client_id and Variation.
+        # client_profiles = dataset with client_id and the demographic columns.
+
+        # Only keeps the events of clients in the experiment, as the inner merge in data_wrangling() does.
+        roster = experiment_roster.drop_duplicates('client_id')
+        web_group = web_group[web_group['client_id'].isin(roster['client_id'])]
+
+        # Factorizes client_id. The codes are the rows of the client table.
+        client_codes, client_ids = pd.factorize(web_group['client_id'], sort=True)
+
+        events = pd.DataFrame({'client_code': client_codes.astype('int32'),
+                               'process_step': web_group['process_step'].to_numpy().astype('int8'),
+                               'date_time': web_group['date_time'].to_numpy().astype('datetime64[s]').astype('int64')})
+
+        visit_ids = None
+        if 'visit_id' in web_group.columns:
+            visit_codes, visit_ids = pd.factorize(web_group['visit_id'])
+            events['visit_code'] = visit_codes.astype('int32')
+            visit_ids = np.asarray(visit_ids)
+
+        # One row per client with the variation and the demographics, as the left merge in data_wrangling() does.
+        clients = pd.DataFrame({'client_id': np.asarray(client_ids)})
+        clients = clients.merge(roster[['client_id', 'Variation']], on='client_id', how='left')
+        clients = clients.merge(client_profiles.drop_duplicates('client_id'), on='client_id', how='left')
+        clients['Variation'] = clients['Variation'].astype('category')
+
+        return cls(events, clients, visit_ids)
+
+    def client_column(self, column):
+        # Returns a client column (Variation or a demographic column) for every event, by looking up the client codes.
+
+        return self.clients[column].take(self.events['client_code'].to_numpy()).reset_index(drop=True)
+
+    def to_frame(self, columns=('Variation',)):
+        # This method rebuilds a regular dataframe of events with client_id, process_step, datetime date_time and the client columns asked for.
+        # With columns=('Variation',) it has the same columns the metric functions in backend.py use from web_group_experiment.
+
+        # Parameters
+        # columns = client columns to join to the events. Only these are copied per event.
+
+        frame = pd.DataFrame({'client_id': self.clients['client_id'].to_numpy()[self.events['client_code'].to_numpy()],
+                              'process_step': self.events['process_step'].to_numpy(),
+                              'date_time': pd.to_datetime(self.events['date_time'].to_numpy(), unit='s')})
+
+        if self.visit_ids is not None:
+            # Missing visit_ids have code -1, which from_codes() turns back into NaN.
+            frame['visit_id'] = np.asarray(pd.Categorical.from_codes(self.events['visit_code'].to_numpy(), categories=self.visit_ids))
+
+        for column in columns:
+            frame[column] = self.client_column(column)
+
+        return frame
+
+    def nbytes(self):
+        # Returns the memory used by the events and by the client table, in bytes.
+
+        return {'events': int(self.events.memory_usage(index=True, deep=True).sum()),
+                'clients': int(self.clients.memory_usage(index=True, deep=True).sum())}
+
+
+def memory_report(web_group, experiment_roster, client_profiles):
+    # This function compares the memory used by the frames data_wrangling() builds with the EventStore, in total and per event.
+
+    # Parameters
+    # web_group, experiment_roster, client_profiles = the dataframes returned by load_data().
+
+    def frame_bytes(frame):
+        return int(frame.memory_usage(index=True, deep=True).sum())
+
+    # Same merges as data_wrangling().
+    web_group_experiment = pd.merge(web_group, experiment_roster, on='client_id', how='inner')
+    client_profile_experiment = pd.merge(web_group_experiment, client_profiles, on='client_id', how='left')
+
+    store = EventStore.from_frames(web_group, experiment_roster, client_profiles)
+    store_bytes = store.nbytes()
+    n_events = len(store.events)
+
+    report = pd.DataFrame({'representation': ['web_group_experiment', 'client_profile_experiment', 'EventStore events',
+                                              'EventStore events + clients'],
+                           'bytes': [frame_bytes(web_group_experiment), frame_bytes(client_profile_experiment),
+                                     store_bytes['events'], store_bytes['events'] + store_bytes['clients']]})
+    report['bytes_per_event'] = report['bytes'] / n_events
+
+    return report
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, t as t_distribution
+from loader import PROCESS_DICT
+from funnel import funnel_counts
+
+
+# Step order used when an experiment has no step order of its own: the five-step funnel of load_data().
+DEFAULT_STEP_ORDER = list(PROCESS_DICT)
+
+
+def encode_experiment_steps(experiment_codes, step_names, experiments, step_orders):
+    # This function turns the step names of every event into its position in the funnel of its experiment, with one lookup table.
+
+    # Parameters
+    # experiment_codes = int array with the position of the experiment of each event in experiments.
+    # step_names = array with the step name of each event.
+    # experiments = list of experiment ids.
+    # step_orders = dictionary of experiment id -> list of step names in funnel order.
+
+    step_categories = pd.Categorical(step_names)
+    names = list(step_categories.categories)
+
+    # Lookup table of experiments x step names. Steps that are not part of an experiment's funnel are -1.
+    lookup = np.full((len(experiments), len(names)), -1, dtype='int64')
+    for row, experiment in enumerate(experiments):
+        for position, name in enumerate(step_orders.get(experiment, DEFAULT_STEP_ORDER)):
+            if name in names:
+                lookup[row, names.index(name)] = position
+
+    codes = lookup[experiment_codes, step_categories.codes]
+    codes[step_categories.codes < 0] = -1
+
+    return codes
+
+
+def run_experiments(events, step_orders=None, control='Control', alpha=0.05, funnel_lengths=None):
+    # This function calculates every funnel metric and test for any number of experiments and arms in one grouped pass.
+    # Events of all experiments are sorted once and counted per (experiment, arm, step) cell, so the runtime grows with the number of
+    # events, not with the number of experiments or arms.
+    # It returns two tables:
+    #   - metrics: one row per experiment, arm and step with clients, drop-off rate, error rate and mean step time, plus the completion rate.
+    #   - tests: one row per experiment and arm (except the control arm) with the completion lift vs the control arm and its
+    #            two-proportion z-test, and the Welch t-test of the mean time of every step.
+
+    # Parameters
+    # events = dataframe with experiment_id, client_id, Variation (the arm), process_step and date_time. process_step can be the step
+    #          names (ordered with step_orders) or numbers already in funnel order.
+    # step_orders = dictionary of experiment id -> list of step names in funnel order. Experiments without one use DEFAULT_STEP_ORDER.
+    # control = name of the control arm in every experiment.
+    # alpha = the probability of rejecting the null hypothesis when it is actually true. The most common value is 0.05.
+    # funnel_lengths = dictionary of experiment id -> number of steps of its funnel, for numerical steps. Experiments without one use the
+    #                  length of their step order. The end of a funnel is never guessed from the data: a funnel that no client finished
+    #                  still has its last step, with a completion rate of 0.
+
+    if step_orders is None:
+        step_orders = {}
+    if funnel_lengths is None:
+        funnel_lengths = {}
+
+    # One group per (experiment, arm).
+    groups = events[['experiment_id', 'Variation']].astype(str)
+    group_codes, group_keys = pd.MultiIndex.from_frame(groups).factorize(sort=True)
+    group_keys = group_keys.to_frame(index=False, name=['experiment_id', 'Variation'])
+
+    experiments = list(group_keys['experiment_id'].unique())
+    experiment_codes = pd.Categorical(groups['experiment_id'], categories=experiments).codes.astype('int64')
+
+    # Length of each experiment's funnel, from funnel_lengths or from its step order.
+    lengths = {experiment: funnel_lengths.get(experiment, len(step_orders.get(experiment, DEFAULT_STEP_ORDER))) for experiment in experiments}
+
+    if events['process_step'].dtype.kind in 'iu':
+        steps = events['process_step'].to_numpy().astype('int64')
+        outside = steps >= np.array([lengths[experiment] for experiment in experiments])[experiment_codes]
+        if outside.any() or (steps < 0).any():
+            raise ValueError("process_step has steps outside the funnel of their experiment. Set funnel_lengths or step_orders.")
+    else:
+        steps = encode_experiment_steps(experiment_codes, events['process_step'].to_numpy(), experiments, step_orders)
+
+    # Events with steps that are not part of their experiment's funnel are left out. The matrices always have a column for the last step
+    # of every funnel, even if no event reached it.
+    n_steps = max(lengths.values())
+    known = steps >= 0
+    counts = funnel_counts(group_codes.astype('int64')[known], len(group_keys), events['client_id'].to_numpy()[known], steps[known],
+                           events['date_time'].to_numpy().astype('datetime64[ns]').astype('int64')[known], n_steps)
+
+    # Last step of each group's funnel.
+    last_steps = group_keys['experiment_id'].map(lengths).to_numpy() - 1
+    rows = np.arange(len(group_keys))
+
+    # Completion: clients that reached the last step of their funnel.
+    completions = counts['reached_counts'][rows, last_steps]
+    clients = counts['client_counts']
+
+    # Per-step metrics for every group at once. Steps after the end of a group's funnel are left out.
+    reached = counts['reached_counts'].astype('float64')
+    next_reached = np.concatenate([reached[:, 1:], np.zeros((len(rows), 1))], axis=1)
+    dropped_off = np.where(np.arange(n_steps) == last_steps[:, None], 0, reached - next_reached)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dropoff_rates = dropped_off / reached * 100
+        error_rates = counts['error_counts'] / counts['event_counts'] * 100
+        mean_seconds = counts['time_sums'] / 1e9 / counts['time_counts']
+        var_seconds = (counts['time_sq_sums'] - counts['time_counts'] * mean_seconds ** 2) / (counts['time_counts'] - 1)
+
+    in_funnel = np.arange(n_steps) <= last_steps[:, None]
+    group_index, step_index = np.nonzero(in_funnel)
+
+    metrics = group_keys.iloc[group_index].reset_index(drop=True)
+    metrics['process_step'] = step_index
+    metrics['clients_at_step'] = counts['reached_counts'][group_index, step_index]
+    metrics['dropoff_rate'] = dropoff_rates[group_index, step_index]
+    metrics['error_rate'] = error_rates[group_index, step_index]
+    metrics['avg_time_per_step_seconds'] = np.where(step_index > 0, mean_seconds[group_index, step_index], np.nan)
+    metrics['completion_rate'] = (completions / clients * 100)[group_index]
+
+    # Pairs every arm with the control arm of its experiment.
+    control_rows = pd.Series(rows[group_keys['Variation'] == control],
+                             index=group_keys.loc[group_keys['Variation'] == control, 'experiment_id'])
+    arm_rows = rows[(group_keys['Variation'] != control) & group_keys['experiment_id'].isin(control_rows.index)]
+    arm_controls = control_rows.reindex(group_keys.loc[arm_rows, 'experiment_id']).to_numpy()
+
+    # Two-proportion z-test of the completion rates, for every pair at once. Same test as proportions_ztest() in statistic_func().
+    arm_rates = completions[arm_rows] / clients[arm_rows]
+    control_rates = completions[arm_controls] / clients[arm_controls]
+    pooled_rates = (completions[arm_rows] + completions[arm_controls]) / (clients[arm_rows] + clients[arm_controls])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_statistics = (arm_rates - control_rates) / np.sqrt(pooled_rates * (1 - pooled_rates) * (1 / clients[arm_rows] + 1 / clients[arm_controls]))
+    z_p_values = 2 * norm.sf(np.abs(z_statistics))
+
+    tests = group_keys.iloc[arm_rows].reset_index(drop=True)
+    tests['control'] = control
+    tests['completion_rate'] = arm_rates * 100
+    tests['control_completion_rate'] = control_rates * 100
+    tests['completion_lift'] = (arm_rates - control_rates) * 100
+    tests['z_statistic'] = z_statistics
+    tests['p_value'] = z_p_values
+    tests['reject'] = z_p_values < alpha
+
+    # Welch t-test of the mean time of every step, for every pair at once.
+    arm_variance = var_seconds[arm_rows] / counts['time_counts'][arm_rows]
+    control_variance = var_seconds[arm_controls] / counts['time_counts'][arm_controls]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_statistics = (mean_seconds[arm_rows] - mean_seconds[arm_controls]) / np.sqrt(arm_variance + control_variance)
+        degrees_of_freedom = (arm_variance + control_variance) ** 2 / (arm_variance ** 2 / (counts['time_counts'][arm_rows] - 1)
+                                                                      + control_variance ** 2 / (counts['time_counts'][arm_controls] - 1))
+    t_p_values = 2 * t_distribution.sf(np.abs(t_statistics), degrees_of_freedom)
+
+    for step in range(1, n_steps):
+        tests[f'time_diff_seconds_step_{step}'] = mean_seconds[arm_rows, step] - mean_seconds[arm_controls, step]
+        tests[f'time_p_value_step_{step}'] = t_p_values[:, step]
+
+    return metrics, tests
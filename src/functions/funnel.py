@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from loader import PROCESS_DICT, STEP_NAMES
+
+
+def funnel_counts(group_codes, n_groups, client_ids, steps, times, n_steps=None):
+    # This function does the single pass over the events behind FunnelMetrics, TransitionMatrix (and so error_rate() in backend.py) and
+    # the multi-experiment pipeline in experiments.py. It sorts the events once by group, client and time (np.lexsort is stable, like
+    # sort_values() on several columns), builds the per-event transition arrays with NumPy and counts everything per (group, step) cell
+    # with np.bincount. It also counts every step-to-step transition in two (n_groups, n_steps + 1, n_steps + 1) matrices. Rows are the
+    # step a client comes from, columns the step it goes to. The extra last row is 'entry' (the first event of a client) and the extra
+    # last column is 'exit' (after the last event of a client).
+    #   - transitions: every transition, so each event is counted once in its column.
+    #   - first_transitions: only the transitions into a step the client had never been at, so each column sums to the clients that reached the step.
+
+    # Parameters
+    # group_codes = int array with the group of each event (for example the variation), from 0 to n_groups - 1.
+    # n_groups = number of groups.
+    # client_ids = array with the client of each event.
+    # steps = int array with the step of each event, from 0 to n_steps - 1.
+    # times = int64 array with the timestamp of each event, in nanoseconds.
+    # n_steps = number of steps. Default is None which takes it from the data.
+
+    order = np.lexsort((times, client_ids, group_codes))
+    group_codes = group_codes[order]
+    client_ids = client_ids[order]
+    steps = steps[order]
+    times = times[order]
+
+    if n_steps is None:
+        n_steps = int(steps.max()) + 1
+
+    n_cells = n_groups * n_steps
+    shape = (n_groups, n_steps)
+
+    # Marks the first event of each client in each group. The previous step of a client's first event doesn't exist.
+    new_client = np.r_[True, (client_ids[1:] != client_ids[:-1]) | (group_codes[1:] != group_codes[:-1])]
+    previous_steps = np.r_[-1, steps[:-1]]
+    previous_steps[new_client] = -1
+    has_previous = previous_steps >= 0
+
+    # Transition arrays: a backward step is an error, and the time from the previous event is the time spent to get to the step.
+    errors = previous_steps > steps
+    time_diffs = np.where(has_previous, times - np.r_[0, times[:-1]], 0)
+
+    counts = {'n_steps': n_steps}
+
+    # Counts everything per (group, step) cell.
+    cells = group_codes * n_steps + steps
+    counts['event_counts'] = np.bincount(cells, minlength=n_cells).reshape(shape)
+    counts['error_counts'] = np.bincount(cells, weights=errors, minlength=n_cells).astype('int64').reshape(shape)
+    counts['time_counts'] = np.bincount(cells, weights=has_previous, minlength=n_cells).astype('int64').reshape(shape)
+
+    # Time sums are added with np.add.at so they stay exact int64 nanoseconds.
+    time_sums = np.zeros(n_cells, dtype='int64')
+    np.add.at(time_sums, cells, time_diffs)
+    counts['time_sums'] = time_sums.reshape(shape)
+
+    # Sums of squared times in seconds, for the variance of the step times.
+    counts['time_sq_sums'] = np.bincount(cells, weights=np.square(time_diffs / 1e9), minlength=n_cells).reshape(shape)
+
+    # Client x step "reached" pairs: each (client, step) is counted once, whatever the number of visits. np.unique with return_index
+    # also gives the first visit of each client to each step in the sorted events.
+    client_codes = np.cumsum(new_client) - 1
+    reached, first_visits = np.unique(client_codes * n_steps + steps, return_index=True)
+    client_groups = group_codes[new_client]
+    counts['reached_counts'] = np.bincount(client_groups[reached // n_steps] * n_steps + reached % n_steps,
+                                           minlength=n_cells).reshape(shape)
+    counts['client_counts'] = np.bincount(client_groups, minlength=n_groups)
+
+    # Transition matrices. 'entry' and 'exit' are both the extra position n_steps.
+    size = n_steps + 1
+    from_steps = np.where(has_previous, previous_steps, n_steps)
+    last_event = np.r_[new_client[1:], True]
+    transition_cells = (group_codes * size + from_steps) * size + steps
+    exit_cells = (group_codes[last_event] * size + steps[last_event]) * size + n_steps
+    matrix_shape = (n_groups, size, size)
+    counts['transitions'] = np.bincount(np.concatenate([transition_cells, exit_cells]),
+                                        minlength=n_groups * size * size).reshape(matrix_shape)
+    counts['first_transitions'] = np.bincount(transition_cells[first_visits], minlength=n_groups * size * size).reshape(matrix_shape)
+
+    return counts
+
+
+def dropoff_from_counts(clients_at_step):
+    # This function calculates the drop-off rate of every step from the number of unique clients at each step. It is used by
+    # drop_off_rate() and drop_off_rates() in backend.py, FunnelMetrics and TransitionMatrix, so every engine gives the same rates.
+
+    # Parameters
+    # clients_at_step = dataframe with one row per group (for example per variation) and one column per process step (0, 1, 2, ...).
+    #                   Each cell is the number of unique clients that were at that step.
+
+    counts = clients_at_step.to_numpy().astype('float64')
+
+    # Finds the last step each group reached. Steps after it don't exist for the group.
+    steps = np.arange(counts.shape[1])
+    last_step = np.where(counts > 0, steps, -1).max(axis=1)
+
+    # Calculates how many clients didn't reach the next step, for all steps at once.
+    next_step_clients = np.concatenate([counts[:, 1:], np.zeros((counts.shape[0], 1))], axis=1)
+    dropped_off_clients = counts - next_step_clients
+
+    # Excludes last step (4,'confirmation') since we assume clients click confirm and leave the program.
+    dropped_off_clients[steps == last_step[:, None]] = 0
+
+    # Calculates the rate of the clients that dropped each step.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dropoff_rates = dropped_off_clients / counts * 100
+
+    dropoff_rates[steps > last_step[:, None]] = np.nan
+
+    return pd.DataFrame(dropoff_rates, index=clients_at_step.index, columns=clients_at_step.columns)
+
+
+class FunnelMetrics:
+    # This class calculates completion rate, average time per step, error rate and drop-off rate for every variation at once.
+    # The functions in backend.py filter and sort the whole dataset on every call. Here the data is sorted once, turned into NumPy arrays,
+    # and every metric is counted per (variation, step) cell with np.bincount. The results are the same as the backend functions.
+    #
+    # Usage:
+    #   metrics = FunnelMetrics(web_group_experiment)
+    #   metrics.summary()                    -> one table with every metric for every variation.
+    #   metrics.error_rate('Test')           -> same as error_rate(web_group_experiment, 'Test').
+
+    def __init__(self, data):
+        # Parameters
+        # data = dataset which must contain client_id, Variation, process_step (numerical) and date_time. Each client must be in one variation.
+
+        # Variations sorted alphabetically, so Control comes before Test.
+        variation = pd.Categorical(data['Variation'].to_numpy())
+        self.variations = list(variation.categories)
+
+        # Sorts the data once and counts every metric per (variation, step) cell. Any funnel length is supported.
+        counts = funnel_counts(variation.codes.astype('int64'), len(self.variations), data['client_id'].to_numpy(),
+                               data['process_step'].to_numpy().astype('int64'),
+                               data['date_time'].to_numpy().astype('datetime64[ns]').astype('int64'))
+
+        self.set_counts(counts)
+
+    @classmethod
+    def from_counts(cls, variations, counts):
+        # This method builds the metrics from counts that were already made by funnel_counts(), for example by adding up the counts of
+        # several shards of clients (see sharding.py).
+
+        # Parameters
+        # variations = names of the variations, in the order of the rows of the counts.
+        # counts = dictionary returned by funnel_counts().
+
+        metrics = cls.__new__(cls)
+        metrics.variations = list(variations)
+        metrics.set_counts(counts)
+
+        return metrics
+
+    def set_counts(self, counts):
+        # Stores the count matrices returned by funnel_counts(). The transition matrices are None when the counts don't have them, like
+        # the ones of StreamingAggregator.
+
+        self.n_steps = counts['n_steps']
+        self.event_counts = counts['event_counts']
+        self.error_counts = counts['error_counts']
+        self.time_counts = counts['time_counts']
+        self.time_sums = counts['time_sums']
+        self.reached_counts = counts['reached_counts']
+        self.client_counts = counts['client_counts']
+        self.transitions = counts.get('transitions')
+        self.first_transitions = counts.get('first_transitions')
+
+    def rows(self, variation=None):
+        # Returns the rows of the count matrices for a variation, or all rows for the overall numbers.
+
+        if variation in self.variations:
+            return [self.variations.index(variation)]
+
+        return list(range(len(self.variations)))
+
+    def completion_rate(self, variation=None):
+        # Same as calculate_completion_rate(data, variation).
+
+        rows = self.rows(variation)
+
+        # The last column is the highest step in the data, so 'confirm' is looked up by its number. Nobody completed if it's not there.
+        confirm = PROCESS_DICT['confirm']
+        completed = self.reached_counts[rows, confirm].sum() if confirm < self.n_steps else 0
+
+        return completed / self.client_counts[rows].sum() * 100
+
+    def avg_time_per_step(self, variation=None):
+        # Same as calculate_avg_time_per_step(data, variation). Variation can be one of the variations, 'Overall', or None for Control, Test and Overall.
+
+        if variation is None:
+            return self.avg_time_per_step('Control'), self.avg_time_per_step('Test'), self.avg_time_per_step('Overall')
+
+        rows = self.rows(variation)
+
+        # Excludes 'start' (step 0) and the steps that never appeared.
+        event_counts = self.event_counts[rows].sum(axis=0)[1:]
+        present = event_counts > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = self.time_sums[rows].sum(axis=0)[1:][present] / self.time_counts[rows].sum(axis=0)[1:][present]
+
+        index = pd.Index([STEP_NAMES.get(step, step) for step in np.flatnonzero(present) + 1], name='process_step')
+
+        return pd.Series(pd.to_timedelta(means, unit='ns'), index=index, name='time_diff')
+
+    def error_rate(self, variation=None):
+        # Same as error_rate(data, variation).
+
+        rows = self.rows(variation)
+        event_counts = self.event_counts[rows].sum(axis=0)
+        error_counts = self.error_counts[rows].sum(axis=0)
+
+        total_errors = error_counts.sum()
+        total_steps = event_counts.sum()
+        error_rate = total_errors / total_steps * 100
+
+        present = event_counts > 0
+        average_error_per_step = pd.Series(error_counts[present] / event_counts[present] * 100,
+                                           index=pd.Index(np.flatnonzero(present), name='process_step'), name='process_step')
+
+        return total_errors, total_steps, error_rate, average_error_per_step
+
+    def drop_off_rate(self, variation=None):
+        # Same as drop_off_rate(data, variation).
+
+        clients_at_step = self.reached_counts[self.rows(variation)].sum(axis=0)
+        clients_at_step = clients_at_step[:np.flatnonzero(clients_at_step).max() + 1]
+        dropoff_rate = dropoff_from_counts(pd.DataFrame([clients_at_step])).iloc[0]
+
+        return pd.DataFrame({'process_step': dropoff_rate.index.to_numpy(), 'dropoff_rate': dropoff_rate.to_numpy()})
+
+    def summary(self):
+        # This method returns every metric for every variation and overall in one tidy table.
+        # Columns: variation, metric, process_step (None for the metrics that are not per step) and value.
+
+        results = []
+
+        for variation in self.variations + ['Overall']:
+
+            results.append({'variation': variation, 'metric': 'completion_rate', 'process_step': None,
+                            'value': self.completion_rate(variation)})
+
+            total_errors, total_steps, error_rate, average_error_per_step = self.error_rate(variation)
+            results.append({'variation': variation, 'metric': 'error_rate', 'process_step': None, 'value': error_rate})
+
+            for step, value in average_error_per_step.items():
+                results.append({'variation': variation, 'metric': 'error_rate_per_step', 'process_step': step, 'value': value})
+
+            for step, value in self.drop_off_rate(variation).itertuples(index=False):
+                results.append({'variation': variation, 'metric': 'dropoff_rate', 'process_step': step, 'value': value})
+
+            # Average time per step is given in seconds so every value in the table is a number.
+            for step, value in self.avg_time_per_step(variation).items():
+                results.append({'variation': variation, 'metric': 'avg_time_per_step_seconds', 'process_step': PROCESS_DICT.get(step, step),
+                                'value': value.total_seconds()})
+
+        return pd.DataFrame(results)
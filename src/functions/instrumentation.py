@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import functools
+import threading
+import tracemalloc
+import pandas as pd
+
+
+# Environment variables that turn the instrumentation on without editing code:
+#   AB_INSTRUMENT = file where the events are written as JSON lines. Use '-' for stderr.
+#   AB_INSTRUMENT_TRACEMALLOC = 1 to also record the Python memory allocated by each stage (slower).
+#   AB_INSTRUMENT_PROFILE = file where the cProfile stats of the whole run are written (read them with pstats or snakeviz).
+ENVIRONMENT_OUTPUT = 'AB_INSTRUMENT'
+ENVIRONMENT_TRACEMALLOC = 'AB_INSTRUMENT_TRACEMALLOC'
+ENVIRONMENT_PROFILE = 'AB_INSTRUMENT_PROFILE'
+
+MB = 2 ** 20
+
+
+def rss_bytes():
+    # Returns the memory used by the process (resident set size) in bytes, or None where it can't be read cheaply.
+
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def row_count(value):
+    # Returns the number of rows of a dataframe or Series, or None for anything else.
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    return None
+
+
+class Stage:
+    # This class times one stage of the pipeline and records its rows and memory. It's used through stage() as a context manager:
+    #   with stage('data_wrangling.merge_roster', rows_in=len(web_group)) as current:
+    #       merged = pd.merge(...)
+    #       current.rows_out = len(merged)
+
+    def __init__(self, instrumentation, name, rows_in=None, **fields):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.fields = fields
+        self.peak = 0
+
+    def __enter__(self):
+        stack = self.instrumentation.stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+
+        if self.instrumentation.trace_memory:
+            # The peak of tracemalloc is global, so the peak so far is handed to the enclosing stage before it's reset for this one.
+            traced, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.traced_start = traced
+
+        self.rss_start = rss_bytes()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.instrumentation.stack().pop()
+
+        event = {'event': 'stage', 'stage': self.name, 'parent': None if self.parent is None else self.parent.name,
+                 'start': self.wall_start, 'seconds': seconds, 'rows_in': self.rows_in, 'rows_out': self.rows_out}
+
+        rss_end = rss_bytes()
+        if rss_end is not None and self.rss_start is not None:
+            event['rss_mb'] = rss_end / MB
+            event['rss_delta_mb'] = (rss_end - self.rss_start) / MB
+
+        if self.instrumentation.trace_memory:
+            traced, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+            event['traced_delta_mb'] = (traced - self.traced_start) / MB
+            event['traced_peak_mb'] = (self.peak - self.traced_start) / MB
+
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+
+        event.update(self.fields)
+        self.instrumentation.emit(event)
+
+        return False
+
+
+class NullStage:
+    # Stage used when the instrumentation is off. It does nothing, so instrumented code costs almost nothing.
+
+    rows_in = None
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Instrumentation:
+    # This class holds the state of the instrumentation: whether it's on, where the events go and the optional profilers.
+    # It's off by default. Turn it on with enable() or with the environment variables at the top of this file.
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.output = None
+        self.owns_output = False
+        self.started_tracemalloc = False
+        self.profiler = None
+        self.profile_path = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def stack(self):
+        # Returns the stages that are running in this thread, outermost first.
+
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def enable(self, output='-', trace_memory=False, profile_path=None):
+        # This method turns the instrumentation on.
+
+        # Parameters
+        # output = file path where the events are written as JSON lines, '-' for stderr, or any object with a write() method.
+        # trace_memory = record the Python memory allocated by each stage with tracemalloc. It makes the run slower.
+        # profile_path = file where the cProfile stats are written when disable() is called. Default is None which doesn't profile.
+
+        self.disable()
+
+        # Files opened here are closed by disable(). Streams given by the caller are left open.
+        self.owns_output = isinstance(output, str) and output != '-'
+        self.output = sys.stderr if output == '-' else open(output, 'a') if self.owns_output else output
+        self.trace_memory = trace_memory
+        self.enabled = True
+
+        # tracemalloc is only stopped by disable() if it was started here.
+        self.started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+
+        if profile_path is not None:
+            self.profile_path = profile_path
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        return self
+
+    def disable(self):
+        # This method turns the instrumentation off, and writes the cProfile stats if they were captured.
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.emit({'event': 'profile', 'path': self.profile_path})
+            self.profiler = None
+
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+        if self.owns_output:
+            self.output.close()
+
+        self.enabled = False
+        self.trace_memory = False
+        self.output = None
+        self.owns_output = False
+        self.started_tracemalloc = False
+
+    def emit(self, event):
+        # Writes one event as a JSON line.
+
+        if self.output is None:
+            return
+
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+
+# Instrumentation shared by the whole pipeline.
+instrumentation = Instrumentation()
+
+
+def stage(name, rows_in=None, **fields):
+    # Returns a context manager that records a stage of the pipeline, or a no-op one when the instrumentation is off.
+
+    # Parameters
+    # name = name of the stage, for example 'data_wrangling.merge_roster'.
+    # rows_in = number of rows going into the stage. rows_out can be set on the returned stage.
+    # fields = any other values added to the event.
+
+    if not instrumentation.enabled:
+        return NULL_STAGE
+
+    return Stage(instrumentation, name, rows_in, **fields)
+
+
+def instrument(name=None):
+    # This decorator records every call of a function as a stage. rows_in is the rows of the first dataframe argument and rows_out the
+    # rows of the result, if it's a dataframe or Series.
+
+    # Parameters
+    # name = name of the stage. Default is None which uses the name of the function.
+
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def instrumented_func(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+
+            rows_in = next((row_count(argument) for argument in args if row_count(argument) is not None), None)
+            with Stage(instrumentation, stage_name, rows_in) as current:
+                result = func(*args, **kwargs)
+                current.rows_out = row_count(result)
+
+            return result
+
+        return instrumented_func
+
+    return decorator
+
+
+def enable(output='-', trace_memory=False, profile_path=None):
+    # Turns the instrumentation on. See Instrumentation.enable().
+
+    return instrumentation.enable(output, trace_memory, profile_path)
+
+
+def disable():
+    # Turns the instrumentation off. See Instrumentation.disable().
+
+    instrumentation.disable()
+
+
+def configure_from_environment():
+    # Turns the instrumentation on if AB_INSTRUMENT is set, so production runs can be instrumented without editing code.
+
+    output = os.environ.get(ENVIRONMENT_OUTPUT)
+    if not output:
+        return
+
+    enable(output, trace_memory=os.environ.get(ENVIRONMENT_TRACEMALLOC, '') not in ('', '0'),
+           profile_path=os.environ.get(ENVIRONMENT_PROFILE) or None)
+
+    # Writes the profile and closes the events file when the run ends.
+    atexit.register(disable)
+
+
+configure_from_environment()
@@ -0,0 +1,150 @@
+import os
+import hashlib
+import pandas as pd
+from instrumentation import stage
+
+
+# Names of the raw files as they are stored in data/raw.
+RAW_FILES = {'client_profiles': 'df_final_demo.csv',
+             'web_data_pt1': 'df_final_web_data_pt_1.csv',
+             'web_data_pt2': 'df_final_web_data_pt_2.csv',
+             'experiment_roster': 'df_final_experiment_clients.csv'}
+
+# Same mapping used in load_data() to turn process steps into numbers.
+PROCESS_DICT = {'start': 0, 'step_1': 1, 'step_2': 2, 'step_3': 3, 'confirm': 4}
+
+# Names of the steps by their number, as calculate_avg_time_per_step() renames them.
+STEP_NAMES = {step: name for name, step in PROCESS_DICT.items()}
+
+# Explicit column types for every raw file. Demographic columns stay as float because they contain missing values.
+CLIENT_PROFILE_DTYPES = {'client_id': 'int64', 'clnt_tenure_yr': 'float64', 'clnt_tenure_mnth': 'float64',
+                         'clnt_age': 'float64', 'gendr': 'object', 'num_accts': 'float64', 'bal': 'float64',
+                         'calls_6_mnth': 'float64', 'logons_6_mnth': 'float64'}
+
+WEB_DATA_DTYPES = {'client_id': 'int64', 'visitor_id': 'object', 'visit_id': 'object', 'process_step': 'category'}
+
+EXPERIMENT_ROSTER_DTYPES = {'client_id': 'int64', 'Variation': 'category'}
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Version of the way read_raw_file() parses the files. Bump it when the parsing changes in a way the settings above don't show, so the
+# Parquet cache made by older versions is not reused.
+LOADER_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    # This function returns the sha256 hash of a file. It is used as the cache key so a cached file is only reused while the source file is unchanged.
+
+    # Parameters
+    # path = path to the file.
+    # chunk_size = number of bytes read at a time so big files are never fully loaded in memory.
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def parser_hash():
+    # This function returns a hash of everything that decides how a raw file is parsed: LOADER_VERSION, the column types, the date
+    # format, the step mapping and the pandas version. It is part of the cache file names, so the cache is rebuilt when one changes.
+
+    settings = (LOADER_VERSION, CLIENT_PROFILE_DTYPES, WEB_DATA_DTYPES, EXPERIMENT_ROSTER_DTYPES, DATE_FORMAT, PROCESS_DICT,
+                pd.__version__)
+
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def encode_process_step(process_step):
+    # This function turns the text process steps ('start', 'step_1', ...) into int8 codes (0-4).
+    # Mapping the categories instead of every row means the text is only compared once per distinct step.
+
+    # Parameters
+    # process_step = Series with the process steps as text or as a categorical.
+
+    return process_step.astype('category').map(PROCESS_DICT).astype('int8')
+
+
+def read_raw_file(path, name):
+    # This function parses one raw CSV with explicit column types.
+
+    # Parameters
+    # path = path to the CSV.
+    # name = key of the file in RAW_FILES. It tells which column types to use.
+
+    if name == 'client_profiles':
+
+        data = pd.read_csv(path, dtype=CLIENT_PROFILE_DTYPES)
+
+    elif name == 'experiment_roster':
+
+        # Drops the clients without variation, the same way load_data() does.
+        data = pd.read_csv(path, dtype=EXPERIMENT_ROSTER_DTYPES)
+        data.dropna(inplace=True)
+
+    else:
+
+        # Reads the web data. The date format is given explicitly so pandas doesn't have to guess it on every row.
+        data = pd.read_csv(path, dtype=WEB_DATA_DTYPES, parse_dates=['date_time'], date_format=DATE_FORMAT)
+
+        # Replacing process step with numerical values, stored as int8.
+        data['process_step'] = encode_process_step(data['process_step'])
+
+    return data
+
+
+def load_raw_file(path, name, cache_dir=None):
+    # This function returns one parsed raw file. If cache_dir is given, the parsed file is stored there as Parquet, keyed on the hash of the CSV and of the parsing settings (see parser_hash()), and later calls read the Parquet file instead of parsing the CSV again.
+
+    # Parameters
+    # path = path to the CSV.
+    # name = key of the file in RAW_FILES.
+    # cache_dir = folder for the Parquet cache. Default is None which always parses the CSV.
+
+    if cache_dir is None:
+        with stage('loader.parse_csv', file=name) as current:
+            data = read_raw_file(path, name)
+            current.rows_out = len(data)
+        return data
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, f"{name}-{file_hash(path)[:16]}-{parser_hash()[:8]}.parquet")
+
+    if os.path.exists(cache_path):
+        with stage('loader.read_cache', file=name) as current:
+            data = pd.read_parquet(cache_path)
+            current.rows_out = len(data)
+        return data
+
+    with stage('loader.parse_csv', file=name) as current:
+        data = read_raw_file(path, name)
+        current.rows_out = len(data)
+
+    # Writes to a temporary file first so an interrupted run never leaves a half written cache file behind.
+    temporary_path = cache_path + '.tmp'
+    data.to_parquet(temporary_path)
+    os.replace(temporary_path, cache_path)
+
+    return data
+
+
+def load_local_data(data_dir='data/raw', cache_dir='data/cache'):
+    # This function is the offline version of load_data(). It reads the four raw files from a local folder and returns the same three dataframes.
+
+    # Parameters
+    # data_dir = folder containing the raw CSV files (see RAW_FILES).
+    # cache_dir = folder for the Parquet cache. Use None to disable the cache.
+
+    paths = {name: os.path.join(data_dir, file_name) for name, file_name in RAW_FILES.items()}
+
+    client_profiles = load_raw_file(paths['client_profiles'], 'client_profiles', cache_dir)
+    experiment_roster = load_raw_file(paths['experiment_roster'], 'experiment_roster', cache_dir)
+    df_web_data_pt1 = load_raw_file(paths['web_data_pt1'], 'web_data_pt1', cache_dir)
+    df_web_data_pt2 = load_raw_file(paths['web_data_pt2'], 'web_data_pt2', cache_dir)
+
+    # Concatenates both parts of the web data, as load_data() does.
+    web_group = pd.concat([df_web_data_pt1, df_web_data_pt2])
+
+    return client_profiles, experiment_roster, web_group
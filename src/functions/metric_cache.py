@@ -0,0 +1,200 @@
+import os
+import copy
+import pickle
+import inspect
+import hashlib
+import functools
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import backend
+
+
+# Version of the cache format. It's part of every key, so bumping it makes the results stored on disk by older versions unreachable.
+# Bump it when a metric changes in code the wrapped function calls (the source of the wrapped function itself is already in the key).
+CACHE_VERSION = 3
+
+# Columns the backend metric functions read. Only these columns are fingerprinted, so the id columns of the web data don't have to be
+# hashed on every call.
+METRIC_COLUMNS = ['client_id', 'Variation', 'process_step', 'date_time']
+
+
+def frame_fingerprint(data, columns=None):
+    # This function returns a fingerprint of the content of a dataframe. Two frames with the same columns, types, index and values get the same
+    # fingerprint. Numerical and datetime columns are hashed straight from their memory, categorical columns from their codes and
+    # categories, a RangeIndex from its bounds and other columns (object or string, like a Variation column read from CSV) from their
+    # pd.factorize codes and unique values. Each is a single pass over the data, much cheaper than the sorts and groupbys of the metric
+    # functions. The content is hashed on every call, so a frame changed in place gets a new fingerprint.
+
+    # Parameters
+    # data = dataframe or Series.
+    # columns = only fingerprint these columns (the ones that are in data). Default is None which uses every column.
+
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+
+    if columns is not None:
+        data = data[[column for column in data.columns if column in columns]]
+
+    sha = hashlib.sha256()
+    sha.update(repr((data.shape, list(data.columns), [str(dtype) for dtype in data.dtypes])).encode())
+
+    if isinstance(data.index, pd.RangeIndex):
+        sha.update(repr(data.index).encode())
+        arrays = [data[column] for column in data.columns]
+    else:
+        arrays = [data.index] + [data[column] for column in data.columns]
+
+    for values in arrays:
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = pd.Categorical(values)
+            sha.update(pd.util.hash_array(np.asarray(values.categories, dtype=object)))
+            array = values.codes
+        else:
+            # Timezone aware datetimes have kind 'M' but become an object array, so the kind of the array is checked too.
+            array = values.to_numpy() if values.dtype.kind in 'biufcmM' else None
+
+        if array is None or array.dtype == object:
+            # The codes and the unique values hold the whole content. Unique values are few for columns like Variation.
+            array, uniques = pd.factorize(values)
+            sha.update(pd.util.hash_array(np.asarray(uniques, dtype=object)))
+
+        # The memory is hashed in place, without a copy.
+        sha.update(np.ascontiguousarray(array).view('uint8'))
+
+    return sha.hexdigest()
+
+
+def argument_key(argument, columns=None):
+    # Returns the part of the cache key of one argument: the fingerprint for dataframes and the repr for anything else.
+
+    if isinstance(argument, (pd.DataFrame, pd.Series)):
+        return 'frame:' + frame_fingerprint(argument, columns)
+
+    return repr(argument)
+
+
+@functools.lru_cache(maxsize=None)
+def function_source_hash(func):
+    # Returns a hash of the source code of a function, or an empty string when the source isn't available.
+
+    try:
+        return hashlib.sha256(inspect.getsource(func).encode()).hexdigest()
+    except (OSError, TypeError):
+        return ''
+
+
+class MetricCache:
+    # This class remembers the results of the metric functions. A result is reused when the function is called again with a frame with
+    # the same content and the same arguments. It keeps at most maxsize results in memory (least recently used are dropped first), and can
+    # also store them on disk so they survive restarts. hits and misses count how often a result was reused or computed.
+    #
+    # Usage:
+    #   cache = MetricCache(maxsize=256, cache_dir='data/cache/metrics')
+    #   completion_rate = cache.wrap(calculate_completion_rate)
+    #   completion_rate(web_group_experiment, 'Test')
+
+    def __init__(self, maxsize=128, cache_dir=None):
+        # Parameters
+        # maxsize = maximum number of results kept in memory.
+        # cache_dir = folder to store the results on disk. Default is None which only keeps them in memory.
+
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, func, args, kwargs, columns=None):
+        # Returns the cache key of a call: cache version, function name and source, fingerprint of the frames and the other arguments.
+        # The source is in the key so results stored on disk are not reused after the function changes.
+
+        parts = [f"v{CACHE_VERSION}", f"{func.__module__}.{func.__qualname__}", function_source_hash(func)]
+        parts += [argument_key(argument, columns) for argument in args]
+        parts += [f"{name}={argument_key(argument, columns)}" for name, argument in sorted(kwargs.items())]
+
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def store(self, key, result):
+        # Adds a result to memory, dropping the least recently used one if the cache is full.
+
+        self.results[key] = result
+        self.results.move_to_end(key)
+
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def call(self, func, *args, columns=None, **kwargs):
+        # This method returns the result of func(*args, **kwargs), from the cache if the same call was made before.
+        # columns = only fingerprint these columns of the frame arguments. Default is None which uses every column. Only use it when
+        #           func reads nothing else from the frames.
+
+        key = self.key(func, args, kwargs, columns)
+
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            # Returns a copy so changing the result outside doesn't change the cached one.
+            return copy.deepcopy(self.results[key])
+
+        path = None if self.cache_dir is None else os.path.join(self.cache_dir, key + '.pkl')
+
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+            self.store(key, result)
+            return copy.deepcopy(result)
+
+        self.misses += 1
+        result = func(*args, **kwargs)
+        self.store(key, result)
+
+        if path is not None:
+            # Writes to a temporary file first so an interrupted run never leaves a half written result behind.
+            with open(path + '.tmp', 'wb') as file:
+                pickle.dump(result, file)
+            os.replace(path + '.tmp', path)
+
+        return copy.deepcopy(result)
+
+    def wrap(self, func, columns=None):
+        # This method returns a version of func that uses the cache. It takes the same arguments as func.
+        # columns = columns of the frames that func reads, see call().
+
+        @functools.wraps(func)
+        def cached_func(*args, **kwargs):
+            return self.call(func, *args, columns=columns, **kwargs)
+
+        return cached_func
+
+    def clear(self, disk=False):
+        # This method empties the cache in memory, and on disk if disk is True, and resets the counters.
+
+        self.results.clear()
+        self.hits = 0
+        self.misses = 0
+
+        if disk and self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def info(self):
+        # Returns the hit and miss counters and the number of results in memory.
+
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.results), 'maxsize': self.maxsize}
+
+
+# Cache shared by the cached versions of the backend metric functions below.
+metric_cache = MetricCache()
+
+# Cached versions of the backend metric functions. Same arguments and results as the ones in backend.py.
+calculate_completion_rate = metric_cache.wrap(backend.calculate_completion_rate, METRIC_COLUMNS)
+calculate_avg_time_per_step = metric_cache.wrap(backend.calculate_avg_time_per_step, METRIC_COLUMNS)
+error_rate = metric_cache.wrap(backend.error_rate, METRIC_COLUMNS)
+drop_off_rate = metric_cache.wrap(backend.drop_off_rate, METRIC_COLUMNS)
+drop_off_rates = metric_cache.wrap(backend.drop_off_rates, METRIC_COLUMNS)
@@ -0,0 +1,193 @@
+import os
+import re
+import io
+import html
+import base64
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import colormaps
+
+
+def draw_completion_counts(ax, result):
+    # This function draws the completed and not completed clients of the Control and Test groups, for the two-proportion z-test.
+
+    # Parameters
+    # ax = matplotlib axes to draw on.
+    # result = dictionary returned by stat_test_result() for a two-proportion z-test.
+
+    users_at_last_step_control, users_at_last_step_test = result['count']
+    total_users_control, total_users_test = result['nobs']
+
+    labels = ['Control Group', 'Test Group']
+    success_counts = [users_at_last_step_control, users_at_last_step_test]
+    failure_counts = [total_users_control - users_at_last_step_control, total_users_test - users_at_last_step_test]
+
+    bar_width = 0.35
+    colormap = colormaps['OrRd']
+    ax.bar(labels, success_counts, bar_width, label='Success (Last Step)', color=colormap(0.6))
+    ax.bar(labels, failure_counts, bar_width, bottom=success_counts, label='Failure (Not Last Step)', color=colormap(0.4))
+
+    ax.set_ylabel('Counts')
+    ax.set_title('Completion Rates for Control and Test Groups')
+    ax.legend()
+
+
+def draw_completion_threshold(ax, result, threshold_increase=0.05):
+    # This function draws the completion rates of the Control and Test groups against the Control rate increased by 5%, for the one-sided z-test.
+
+    # Parameters
+    # ax = matplotlib axes to draw on.
+    # result = dictionary returned by stat_test_result() for a one-sided z-test.
+    # threshold_increase = increase of the Control group rate. Default is 0.05.
+
+    users_at_last_step_control, users_at_last_step_test = result['count']
+    total_users_control, total_users_test = result['nobs']
+
+    completion_rate_control = users_at_last_step_control / total_users_control
+    completion_rate_test = users_at_last_step_test / total_users_test
+    threshold_completion_rate = completion_rate_control + threshold_increase
+
+    labels = ['Control Group', 'Test Group']
+    completion_rates = [completion_rate_control, completion_rate_test]
+    threshold_completion_rates = [threshold_completion_rate, threshold_completion_rate]
+
+    bar_width = 0.35
+    bar_positions = np.arange(len(labels))
+    colormap = colormaps['OrRd']
+    ax.bar(bar_positions, completion_rates, bar_width, label='Completion Rate', color=colormap(0.7))
+    ax.bar(bar_positions, threshold_completion_rates, bar_width, alpha=0.5, label='Threshold Completion Rate', color=colormap(0.4))
+
+    ax.axhline(y=threshold_completion_rate, color='red', linestyle='--', label='Threshold')
+
+    ax.set_ylabel('Completion Rate')
+    ax.set_title('Completion Rates for Control and Test Groups')
+    ax.set_xticks(bar_positions)
+    ax.set_xticklabels(labels)
+    ax.legend()
+
+
+# Chart drawn for each test. Tests that are not here only get the HTML summary.
+CHARTS = {'two-proportion z-test': draw_completion_counts,
+          'one-sided z-test': draw_completion_threshold}
+
+
+def draw_result(ax, result):
+    # This function draws the chart of a result of stat_test_result() on ax. It works with pyplot axes (as in statistic_func()) and with
+    # the headless figures of render_result(). Returns False if the test has no chart.
+
+    draw = CHARTS.get(result['stat_test'])
+    if draw is None:
+        return False
+
+    draw(ax, result)
+
+    return True
+
+
+def report_name(result):
+    # Returns a file name for a result, from its evaluator and test. For example 'age_t-test'.
+
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{result['evaluator']}_{result['stat_test']}").strip('_')
+
+
+def result_html(result, images):
+    # Returns an HTML page with the statistics of a result and its charts embedded.
+
+    rows = ''.join(f"<tr><th>{html.escape(str(key))}</th><td>{html.escape(str(result.get(key)))}</td></tr>"
+                   for key in ['evaluator', 'stat_test', 'column', 'statistic', 'p_value', 'alpha', 'reject', 'hypothesis'])
+
+    charts = ''.join(f'<img src="data:{mime};base64,{base64.b64encode(content).decode()}">' for mime, content in images)
+
+    return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(report_name(result))}</title></head>"
+            f"<body><table>{rows}</table>{charts}</body></html>")
+
+
+def render_result(result, output_dir, formats=('png',)):
+    # This function draws the chart of a result and writes it to disk. It never uses pyplot: the figure is drawn with the Agg canvas,
+    # which doesn't need a display and never blocks, and it's cleared as soon as it's written so no figure stays in memory.
+    # Returns the paths of the files written.
+
+    # Parameters
+    # result = dictionary returned by stat_test_result().
+    # output_dir = folder where the files are written.
+    # formats = any of 'png', 'svg' and 'html'. The HTML page has the statistics and the chart.
+
+    os.makedirs(output_dir, exist_ok=True)
+    name = report_name(result)
+    paths = []
+    images = []
+
+    if result['stat_test'] in CHARTS:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        try:
+            draw_result(figure.subplots(), result)
+
+            for file_format in formats:
+                if file_format in ('png', 'svg'):
+                    path = os.path.join(output_dir, f"{name}.{file_format}")
+                    figure.savefig(path, format=file_format)
+                    paths.append(path)
+
+            if 'html' in formats:
+                buffer = io.BytesIO()
+                figure.savefig(buffer, format='png')
+                images.append(('image/png', buffer.getvalue()))
+        finally:
+            figure.clear()
+
+    if 'html' in formats:
+        path = os.path.join(output_dir, f"{name}.html")
+        with open(path, 'w') as file:
+            file.write(result_html(result, images))
+        paths.append(path)
+
+    return paths
+
+
+class ReportRenderer:
+    # This class renders results in the background with a pool of worker processes, so running the tests never waits on matplotlib.
+    #
+    # Usage:
+    #   with ReportRenderer('reports') as renderer:
+    #       for evaluator, stat_test in tests:
+    #           renderer.submit(stat_test_result(data, evaluator, stat_test, 0.05))
+    #   renderer.paths()    -> files written.
+
+    def __init__(self, output_dir, formats=('png',), max_workers=None):
+        # Parameters
+        # output_dir = folder where the files are written.
+        # formats = any of 'png', 'svg' and 'html'.
+        # max_workers = number of worker processes. Default is None which uses every CPU.
+
+        self.output_dir = output_dir
+        self.formats = formats
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def submit(self, result):
+        # This method queues a result to be rendered and returns right away.
+
+        # Only plain values are sent to the worker, never the data.
+        future = self.pool.submit(render_result, dict(result), self.output_dir, self.formats)
+        self.futures.append(future)
+
+        return future
+
+    def paths(self):
+        # This method waits for every queued result and returns the paths of all the files written.
+
+        return [path for future in self.futures for path in future.result()]
+
+    def close(self):
+        # This method waits for the queued results and stops the workers.
+
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
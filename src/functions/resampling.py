@@ -0,0 +1,218 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Maximum number of cells in one resample matrix (resamples x observations). Bounds the memory of a block to about 32 MB of int64.
+MAX_BLOCK_CELLS = 4_000_000
+
+# Values used by the resamples running in a worker process. They are sent once per worker instead of once per block.
+worker_values = {}
+
+
+def set_worker_values(test_values, control_values):
+    # This function stores the values in a worker process. It runs once when each worker starts.
+
+    worker_values['test'] = test_values
+    worker_values['control'] = control_values
+
+
+def bootstrap_block(seed, size):
+    # This function draws a block of bootstrap resamples and returns the difference in means (Test - Control) of each one.
+    # Every resample is a row of an index matrix, so the whole block is drawn and averaged with NumPy at once.
+
+    # Parameters
+    # seed = SeedSequence of the block. Each block has its own so results don't depend on how blocks are split between workers.
+    # size = number of resamples in the block.
+
+    rng = np.random.default_rng(seed)
+    test_values = worker_values['test']
+    control_values = worker_values['control']
+
+    test_means = test_values[rng.integers(0, len(test_values), size=(size, len(test_values)))].mean(axis=1)
+    control_means = control_values[rng.integers(0, len(control_values), size=(size, len(control_values)))].mean(axis=1)
+
+    return test_means - control_means
+
+
+def permutation_block(seed, size):
+    # This function draws a block of permutations of the group labels and returns the difference in means (Test - Control) of each one.
+
+    # Parameters
+    # seed = SeedSequence of the block.
+    # size = number of permutations in the block.
+
+    rng = np.random.default_rng(seed)
+    test_values = worker_values['test']
+    pooled = np.concatenate([test_values, worker_values['control']])
+
+    # Shuffles every row independently. The first len(test_values) values of a row are the resampled Test group.
+    permuted = rng.permuted(np.tile(pooled, (size, 1)), axis=1)
+
+    return permuted[:, :len(test_values)].mean(axis=1) - permuted[:, len(test_values):].mean(axis=1)
+
+
+def run_blocks(block_func, test_values, control_values, n_resamples, seed, n_jobs):
+    # This function splits the resamples into blocks, runs them (in parallel if n_jobs > 1) and returns all the resampled statistics.
+    # Blocks and their seeds only depend on n_resamples, the group sizes and seed, so the results are the same for any n_jobs.
+
+    block_size = max(1, min(n_resamples, MAX_BLOCK_CELLS // (len(test_values) + len(control_values))))
+    sizes = [block_size] * (n_resamples // block_size)
+    if n_resamples % block_size:
+        sizes.append(n_resamples % block_size)
+
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    n_jobs = max(1, min(n_jobs, len(sizes)))
+
+    if n_jobs == 1:
+        set_worker_values(test_values, control_values)
+        try:
+            blocks = [block_func(block_seed, size) for block_seed, size in zip(seeds, sizes)]
+        finally:
+            worker_values.clear()
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=set_worker_values, initargs=(test_values, control_values)) as pool:
+            blocks = list(pool.map(block_func, seeds, sizes))
+
+    return np.concatenate(blocks)
+
+
+def bootstrap_lift(test_values, control_values, n_resamples=10000, confidence=0.95, seed=None, n_jobs=1):
+    # This function calculates a bootstrap confidence interval for the difference in means between the Test and Control groups.
+
+    # Parameters
+    # test_values = values of the Test group, one per observation. For completion use 1 if the client completed and 0 if not.
+    # control_values = values of the Control group.
+    # n_resamples = number of bootstrap resamples.
+    # confidence = confidence level of the interval. The most common value is 0.95.
+    # seed = seed of the random number generator, to get the same results every run. Default is None which gives different results every run.
+    # n_jobs = number of worker processes. Default is 1 which runs in the current process. Use None to use every CPU.
+
+    test_values = np.asarray(test_values, dtype='float64')
+    control_values = np.asarray(control_values, dtype='float64')
+
+    # Without observations in one of the groups there is no lift to estimate.
+    if len(test_values) == 0 or len(control_values) == 0:
+        return {'lift': np.nan, 'ci_low': np.nan, 'ci_high': np.nan, 'confidence': confidence, 'standard_error': np.nan,
+                'n_resamples': n_resamples}
+
+    lift = test_values.mean() - control_values.mean()
+    resampled = run_blocks(bootstrap_block, test_values, control_values, n_resamples, seed, n_jobs)
+
+    # Percentile interval: the middle confidence share of the resampled lifts.
+    ci_low, ci_high = np.quantile(resampled, [(1 - confidence) / 2, (1 + confidence) / 2])
+
+    return {'lift': lift, 'ci_low': ci_low, 'ci_high': ci_high, 'confidence': confidence,
+            'standard_error': resampled.std(ddof=1), 'n_resamples': n_resamples}
+
+
+def permutation_test(test_values, control_values, n_resamples=10000, alternative='two-sided', seed=None, n_jobs=1):
+    # This function tests if the means of the Test and Control groups are different by shuffling the group labels.
+    # Unlike the z-tests in statistic_func(), it doesn't rely on a normal approximation, so it also works for small segments.
+
+    # Parameters
+    # test_values = values of the Test group, one per observation.
+    # control_values = values of the Control group.
+    # n_resamples = number of permutations.
+    # alternative = 'two-sided', 'larger' (Test mean is greater) or 'smaller' (Test mean is lower).
+    # seed = seed of the random number generator.
+    # n_jobs = number of worker processes. Default is 1 which runs in the current process. Use None to use every CPU.
+
+    test_values = np.asarray(test_values, dtype='float64')
+    control_values = np.asarray(control_values, dtype='float64')
+
+    # Without observations in one of the groups there is nothing to test, so the p-value is NaN and not a falsely small 1 / (n + 1).
+    if len(test_values) == 0 or len(control_values) == 0:
+        return {'lift': np.nan, 'p_value': np.nan, 'alternative': alternative, 'n_resamples': n_resamples}
+
+    lift = test_values.mean() - control_values.mean()
+    resampled = run_blocks(permutation_block, test_values, control_values, n_resamples, seed, n_jobs)
+
+    # Small tolerance so permutations equal to the observed lift count as extreme despite floating point rounding.
+    tolerance = 1e-12 * max(1.0, abs(lift))
+
+    if alternative == 'larger':
+        extreme = resampled >= lift - tolerance
+    elif alternative == 'smaller':
+        extreme = resampled <= lift + tolerance
+    else:
+        extreme = np.abs(resampled) >= abs(lift) - tolerance
+
+    # Adds one to both counts so the p-value is never 0, since the observed split is one of the possible permutations.
+    p_value = (extreme.sum() + 1) / (n_resamples + 1)
+
+    return {'lift': lift, 'p_value': p_value, 'alternative': alternative, 'n_resamples': n_resamples}
+
+
+def completion_outcomes(data):
+    # This function returns 1 for each client that reached the last step (4, confirm) and 0 for the others, per variation.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation and process_step, like web_group_experiment.
+
+    completed = (data['process_step'] == 4).groupby([data['Variation'], data['client_id']], observed=True).any()
+
+    return {variation: values.to_numpy().astype('float64') for variation, values in completed.groupby(level='Variation', observed=True)}
+
+
+def step_time_samples(data):
+    # This function returns the time in seconds it took to get to each step, one row per event, as calculate_avg_time_per_step() calculates it.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step and date_time.
+
+    merged_web_data = data.sort_values(by=['client_id', 'date_time'])
+    time_diff = merged_web_data.groupby('client_id')['date_time'].diff().dt.total_seconds()
+
+    samples = pd.DataFrame({'Variation': merged_web_data['Variation'], 'process_step': merged_web_data['process_step'],
+                            'seconds': time_diff})
+
+    # Excludes 'start' (step 0) and the first event of each client, which has no previous event.
+    return samples[(samples['process_step'] != 0) & samples['seconds'].notna()]
+
+
+def completion_lift_tests(data, n_resamples=10000, confidence=0.95, seed=None, n_jobs=1):
+    # This function calculates the Test vs Control completion rate lift with a bootstrap confidence interval and a permutation p-value.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation and process_step, like web_group_experiment.
+    # The other parameters are the same as in bootstrap_lift() and permutation_test().
+
+    outcomes = completion_outcomes(data)
+    test_values = outcomes.get('Test', np.array([]))
+    control_values = outcomes.get('Control', np.array([]))
+
+    bootstrap = bootstrap_lift(test_values, control_values, n_resamples, confidence, seed, n_jobs)
+    permutation = permutation_test(test_values, control_values, n_resamples, seed=seed, n_jobs=n_jobs)
+
+    return {**bootstrap, 'p_value': permutation['p_value'], 'n_test': len(test_values), 'n_control': len(control_values)}
+
+
+def step_time_lift_tests(data, n_resamples=10000, confidence=0.95, seed=None, n_jobs=1):
+    # This function calculates, for each step, the Test vs Control difference in mean time (seconds) with a bootstrap confidence interval and a permutation p-value.
+    # n_test and n_control give the number of observations of each group. Steps where one group has none are flagged with tested = False
+    # and have NaN lift, interval and p-value.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step and date_time, like web_group_experiment.
+    # The other parameters are the same as in bootstrap_lift() and permutation_test().
+
+    samples = step_time_samples(data)
+    results = []
+
+    for step, step_samples in samples.groupby('process_step'):
+        test_values = step_samples.loc[step_samples['Variation'] == 'Test', 'seconds']
+        control_values = step_samples.loc[step_samples['Variation'] == 'Control', 'seconds']
+
+        bootstrap = bootstrap_lift(test_values, control_values, n_resamples, confidence, seed, n_jobs)
+        permutation = permutation_test(test_values, control_values, n_resamples, seed=seed, n_jobs=n_jobs)
+        results.append({'process_step': step, **bootstrap, 'p_value': permutation['p_value'], 'n_test': len(test_values),
+                        'n_control': len(control_values), 'tested': len(test_values) > 0 and len(control_values) > 0})
+
+    return pd.DataFrame(results)
@@ -0,0 +1,129 @@
+import numpy as np
+from loader import PROCESS_DICT
+
+
+class SequentialTest:
+    # This class is an always-valid (sequential) test of the difference in means between the Test and Control groups, using a mixture
+    # sequential probability ratio test (mSPRT). Unlike rerunning statistic_func() every time we look at the experiment, the p-value stays
+    # valid however often it is checked, so peeking doesn't inflate false positives.
+    #
+    # It only keeps three numbers per variation: number of observations, sum and sum of squares. New data is added with update() (raw values)
+    # or update_counts() (completions and totals), and result() reads the p-value and decision without going back to the raw events.
+    #
+    # For completion rate the values are 1 if the client completed and 0 if not. For time per step they are the step times in seconds.
+
+    def __init__(self, alpha=0.05, tau=0.05, variations=('Control', 'Test')):
+        # Parameters
+        # alpha = the probability of rejecting the null hypothesis when it is actually true. The most common value is 0.05.
+        # tau = standard deviation of the effects we expect to see (mixing distribution of the mSPRT), in the units of the values.
+        #       0.05 fits completion rate differences of a few percentage points. For step times in seconds use a value in seconds.
+        # variations = names of the control and test variations, in that order.
+
+        self.alpha = alpha
+        self.tau = tau
+        self.control, self.test = variations
+
+        self.n = {variation: 0 for variation in variations}
+        self.total = {variation: 0.0 for variation in variations}
+        self.total_sq = {variation: 0.0 for variation in variations}
+
+        # Smallest p-value seen so far. The always-valid p-value can only go down.
+        self.p_value = 1.0
+
+    def update(self, variation, values):
+        # This method adds new observations of a variation.
+
+        # Parameters
+        # variation = 'Control' or 'Test'.
+        # values = new observations (array or list).
+
+        values = np.asarray(values, dtype='float64')
+
+        self.n[variation] += len(values)
+        self.total[variation] += values.sum()
+        self.total_sq[variation] += np.square(values).sum()
+
+        return self
+
+    def update_counts(self, variation, completions, total):
+        # This method adds new 0/1 observations of a variation from their counts, for example new clients and how many of them completed.
+
+        # Parameters
+        # variation = 'Control' or 'Test'.
+        # completions = number of new observations equal to 1.
+        # total = number of new observations.
+
+        self.n[variation] += total
+        self.total[variation] += completions
+        self.total_sq[variation] += completions
+
+        return self
+
+    def set_counts(self, variation, completions, total):
+        # This method replaces the 0/1 observations of a variation with cumulative counts, for example the ones kept by a StreamingAggregator.
+
+        self.n[variation] = total
+        self.total[variation] = completions
+        self.total_sq[variation] = completions
+
+        return self
+
+    def update_from_aggregator(self, aggregator):
+        # This method reads the cumulative completion counts of every variation from a StreamingAggregator (see streaming.py).
+
+        # Parameters
+        # aggregator = StreamingAggregator fed with the web data so far.
+
+        for variation in [self.control, self.test]:
+            row = aggregator.variations.index(variation)
+            self.set_counts(variation, aggregator.reached_counts[row, PROCESS_DICT['confirm']], aggregator.client_counts[row])
+
+        return self
+
+    def estimate(self):
+        # Returns the lift (Test mean - Control mean) and its variance, from the sufficient statistics.
+
+        means = {}
+        variances = {}
+        for variation in [self.control, self.test]:
+            n = self.n[variation]
+            means[variation] = self.total[variation] / n
+            variances[variation] = max(self.total_sq[variation] / n - means[variation] ** 2, 0.0) * n / max(n - 1, 1)
+
+        lift = means[self.test] - means[self.control]
+        variance = variances[self.test] / self.n[self.test] + variances[self.control] / self.n[self.control]
+
+        return lift, variance
+
+    def result(self):
+        # This method returns the current lift, always-valid p-value, confidence sequence and decision.
+
+        if min(self.n.values()) < 2:
+            return {'lift': np.nan, 'p_value': self.p_value, 'ci_low': -np.inf, 'ci_high': np.inf, 'reject': False,
+                    'hypothesis': "Fail to reject the null hypothesis: There is not enough data yet.",
+                    'n_control': self.n[self.control], 'n_test': self.n[self.test]}
+
+        lift, variance = self.estimate()
+        tau_sq = self.tau ** 2
+
+        if variance > 0:
+            # Mixture likelihood ratio of "the lift is drawn from N(0, tau^2)" against "the lift is 0".
+            log_ratio = 0.5 * np.log(variance / (variance + tau_sq)) + tau_sq * lift ** 2 / (2 * variance * (variance + tau_sq))
+            self.p_value = min(self.p_value, float(np.exp(-max(log_ratio, 0.0))))
+
+            # Confidence sequence: the lifts for which the likelihood ratio is still below 1 / alpha.
+            half_width = np.sqrt(variance * (variance + tau_sq) / tau_sq
+                                 * (2 * np.log(1 / self.alpha) + np.log((variance + tau_sq) / variance)))
+        else:
+            half_width = 0.0
+
+        reject = self.p_value < self.alpha
+
+        if reject:
+            hypothesis_string = "Reject the null hypothesis: There is evidence that the Test and Control groups are different."
+        else:
+            hypothesis_string = "Fail to reject the null hypothesis: There is no significant evidence yet that the Test and Control groups are different."
+
+        return {'lift': lift, 'p_value': self.p_value, 'ci_low': lift - half_width, 'ci_high': lift + half_width,
+                'reject': reject, 'hypothesis': hypothesis_string,
+                'n_control': self.n[self.control], 'n_test': self.n[self.test]}
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from loader import STEP_NAMES
+
+
+def sessionize(data, timeout='30min', use_visit_id=True):
+    # This function splits the events of each client into sessions and calculates the time to get to each step inside its session.
+    # calculate_avg_time_per_step() diffs timestamps across the whole history of a client, so the time of a client who logs off and
+    # comes back days later is counted as time spent on a step. Here the first event of a session has no time.
+
+    # Parameters
+    # data = dataset which must contain client_id, process_step and date_time. visit_id is used if it is there.
+    # timeout = inactivity gap that starts a new session, anything pd.Timedelta accepts. Use None to only split on visit_id.
+    # use_visit_id = start a new session when visit_id changes. Default is True.
+
+    # Sorts values by client_id and date_time, as the backend functions do. Only this sort is needed, the rest is vectorized.
+    sessions = data.sort_values(by=['client_id', 'date_time']).reset_index(drop=True)
+
+    client_ids = sessions['client_id'].to_numpy()
+    times = sessions['date_time'].to_numpy().astype('datetime64[ns]').astype('int64')
+
+    # Time since the previous event, in seconds.
+    gaps = np.r_[np.nan, np.diff(times) / 1e9]
+
+    # A new session starts with a new client, a new visit or a gap longer than the timeout.
+    new_session = np.r_[True, client_ids[1:] != client_ids[:-1]]
+
+    if use_visit_id and 'visit_id' in sessions.columns:
+        visit_ids = sessions['visit_id'].to_numpy()
+        new_session[1:] |= visit_ids[1:] != visit_ids[:-1]
+
+    if timeout is not None:
+        new_session |= gaps > pd.Timedelta(timeout).total_seconds()
+
+    sessions['session'] = np.cumsum(new_session) - 1
+    sessions['seconds'] = np.where(new_session, np.nan, gaps)
+
+    return sessions
+
+
+def grouped_trimmed_mean(values, groups, proportion):
+    # This function calculates the trimmed mean of values for each group without a Python loop per group.
+    # Like scipy.stats.trim_mean, it cuts int(proportion * n) values from each end of every group.
+
+    # Parameters
+    # values = Series with the values.
+    # groups = list of named Series with the group keys, aligned with values.
+    # proportion = share of values cut from each end.
+
+    frame = pd.DataFrame({group.name: group.to_numpy() for group in groups})
+    frame['value'] = values.to_numpy()
+    keys = list(frame.columns[:-1])
+
+    frame = frame.sort_values(keys + ['value'])
+    position = frame.groupby(keys, observed=True).cumcount()
+    size = frame.groupby(keys, observed=True)['value'].transform('size')
+    cut = np.floor(size * proportion)
+
+    kept = frame[(position >= cut) & (position < size - cut)]
+
+    return kept.groupby(keys, observed=True)['value'].mean()
+
+
+def session_time_per_step(data, timeout='30min', use_visit_id=True, trim=0.1, quantiles=(0.25, 0.5, 0.75, 0.9)):
+    # This function calculates outlier-robust statistics of the time it took clients to get to each step, inside their sessions.
+    # It returns, for each variation and overall, and each step: count, mean, median, trimmed mean and quantiles in seconds.
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step and date_time, like web_group_experiment.
+    # timeout, use_visit_id = how sessions are split, see sessionize().
+    # trim = share of the values cut from each end for the trimmed mean.
+    # quantiles = quantiles to report.
+
+    sessions = sessionize(data, timeout, use_visit_id)
+
+    # Excludes 'start' (step 0) and the first event of each session, which has no time.
+    sessions = sessions[(sessions['process_step'] != 0) & sessions['seconds'].notna()]
+
+    # Stacks the events once per variation and once more as 'Overall'.
+    stacked = pd.concat([sessions[['Variation', 'process_step', 'seconds']].astype({'Variation': 'object'}),
+                         sessions[['process_step', 'seconds']].assign(Variation='Overall')], ignore_index=True)
+
+    grouped = stacked.groupby(['Variation', 'process_step'])['seconds']
+
+    results = grouped.agg(['count', 'mean', 'median'])
+    results['trimmed_mean'] = grouped_trimmed_mean(stacked['seconds'], [stacked['Variation'], stacked['process_step']], trim)
+
+    for quantile in quantiles:
+        results[f'q{round(quantile * 100):02d}'] = grouped.quantile(quantile)
+
+    results = results.rename(index=STEP_NAMES, level='process_step')
+
+    return results
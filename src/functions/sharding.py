@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from funnel import funnel_counts, FunnelMetrics
+
+
+# Count matrices of funnel_counts() that are added up across shards. They are all additive because a client is always in one shard.
+ADDITIVE_COUNTS = ['event_counts', 'error_counts', 'time_counts', 'time_sums', 'time_sq_sums', 'reached_counts', 'client_counts',
+                   'transitions', 'first_transitions']
+
+# Arrays shared with the worker processes, by name. They are attached once per worker instead of being pickled for every shard.
+worker_arrays = {}
+worker_memory = []
+
+
+def shard_of(client_ids, n_shards):
+    # This function hash-partitions clients into shards. The hash only depends on the client_id, so every event of a client is in the
+    # same shard and a client's shard is the same in every run.
+
+    # Parameters
+    # client_ids = array with the client of each event.
+    # n_shards = number of shards.
+
+    return (pd.util.hash_array(np.asarray(client_ids)) % np.uint64(n_shards)).astype('uint16')
+
+
+def share_arrays(arrays):
+    # This function copies arrays into shared memory blocks. Returns the blocks (to close and unlink them later) and the specs the
+    # workers need to attach to them.
+
+    blocks, specs = [], {}
+
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.dtype.str, array.shape)
+
+    return blocks, specs
+
+
+def set_worker_arrays(specs):
+    # This function attaches a worker process to the shared arrays. It runs once when each worker starts.
+
+    for name, (block_name, dtype, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        worker_memory.append(block)
+        worker_arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def shard_counts(start, end, n_groups, n_steps):
+    # This function runs the sort, diff and transition work of one shard: the events from start to end of the shared arrays.
+
+    return funnel_counts(worker_arrays['group_codes'][start:end], n_groups, worker_arrays['client_codes'][start:end],
+                         worker_arrays['steps'][start:end], worker_arrays['times'][start:end], n_steps)
+
+
+def merge_counts(partial_counts, n_groups, n_steps):
+    # This function adds up the partial counts of the shards.
+
+    counts = {'n_steps': n_steps}
+
+    for name in ADDITIVE_COUNTS:
+        if name == 'client_counts':
+            shape = (n_groups,)
+        elif name in ('transitions', 'first_transitions'):
+            shape = (n_groups, n_steps + 1, n_steps + 1)
+        else:
+            shape = (n_groups, n_steps)
+        counts[name] = np.zeros(shape, dtype='float64' if name == 'time_sq_sums' else 'int64')
+        for partial in partial_counts:
+            counts[name] += partial[name]
+
+    return counts
+
+
+def sharded_funnel_metrics(data, n_jobs=None, n_shards=None):
+    # This function calculates the funnel metrics of every variation with the clients split into shards processed in parallel.
+    # Every metric is a per-client sequence computation followed by a sum, so each shard is sorted and counted on its own and the
+    # partial counts are added up. The events are put in shared memory once, grouped by shard, and each worker reads its shards
+    # from there without any copy being pickled. Returns a FunnelMetrics with the same results as FunnelMetrics(data), so:
+    #   metrics = sharded_funnel_metrics(web_group_experiment, n_jobs=8)
+    #   metrics.avg_time_per_step()      -> same as calculate_avg_time_per_step(web_group_experiment).
+    #   metrics.error_rate('Test')       -> same as error_rate(web_group_experiment, 'Test').
+    #   metrics.drop_off_rate()          -> same as drop_off_rate(web_group_experiment).
+
+    # Parameters
+    # data = dataset which must contain client_id, Variation, process_step (numerical) and date_time, like web_group_experiment.
+    # n_jobs = number of worker processes. Default is None which uses every CPU. 1 runs the shards in the current process.
+    # n_shards = number of shards. Default is None which uses 4 shards per worker, so a slow shard doesn't leave the other workers idle.
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    if n_shards is None:
+        n_shards = 4 * n_jobs
+
+    variation = pd.Categorical(data['Variation'].to_numpy())
+    variations = list(variation.categories)
+    steps = data['process_step'].to_numpy().astype('int64')
+    n_steps = int(steps.max()) + 1
+
+    # Groups the events by shard. A stable sort of small integers is a radix sort, so this is a linear pass.
+    shards = shard_of(data['client_id'].to_numpy(), n_shards)
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+
+    arrays = {'group_codes': variation.codes.astype('int64')[order],
+              'client_codes': pd.factorize(data['client_id'])[0].astype('int64')[order],
+              'steps': steps[order],
+              'times': data['date_time'].to_numpy().astype('datetime64[ns]').astype('int64')[order]}
+
+    ranges = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    starts, ends = [start for start, _ in ranges], [end for _, end in ranges]
+    n_groups = [len(variations)] * len(ranges)
+    n_steps_list = [n_steps] * len(ranges)
+
+    if n_jobs == 1:
+        worker_arrays.update(arrays)
+        try:
+            partial_counts = list(map(shard_counts, starts, ends, n_groups, n_steps_list))
+        finally:
+            worker_arrays.clear()
+
+    else:
+        blocks, specs = share_arrays(arrays)
+        del arrays
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=set_worker_arrays, initargs=(specs,)) as pool:
+                partial_counts = list(pool.map(shard_counts, starts, ends, n_groups, n_steps_list))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    return FunnelMetrics.from_counts(variations, merge_counts(partial_counts, len(variations), n_steps))
@@ -0,0 +1,85 @@
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from statsmodels.stats.multitest import multipletests
+from backend import EVALUATOR_COLUMNS, stat_test_result
+
+
+# Tests that compare completion between the groups. They need the web data (process steps), not the client profiles.
+Z_TESTS = ['two-proportion z-test', 'one-sided z-test']
+
+# Evaluators that are categories. They can't be compared with a t-test.
+CATEGORICAL_EVALUATORS = ['gender', 'balance']
+
+# Dataset used by the tests running in a worker process. It is sent once per worker instead of once per test.
+worker_data = {}
+
+
+def set_worker_data(data, event_data):
+    # This function stores the datasets in a worker process. It runs once when each worker starts.
+
+    worker_data['data'] = data
+    worker_data['event_data'] = event_data
+
+
+def run_worker_test(evaluator, stat_test, alpha):
+    # This function runs one test in a worker process with the datasets stored by set_worker_data().
+
+    data = worker_data['event_data'] if stat_test in Z_TESTS else worker_data['data']
+
+    return stat_test_result(data, evaluator, stat_test, alpha)
+
+
+def all_demographic_tests(stat_tests=('t-test', 'chi-test')):
+    # This function returns every (evaluator, stat_test) pair for the demographic columns, to screen them all in one run.
+
+    # Parameters
+    # stat_tests = tests to run on every evaluator.
+
+    return [(evaluator, stat_test) for evaluator in EVALUATOR_COLUMNS for stat_test in stat_tests
+            if not (evaluator in CATEGORICAL_EVALUATORS and stat_test == 't-test')]
+
+
+def run_stat_battery(data, tests, alpha=0.05, correction='holm', event_data=None, n_jobs=1):
+    # This function runs many statistical tests at once, optionally in parallel, without printing or plotting.
+    # It returns one table with a row per test: statistic, p-value and decision, plus the p-value and decision after correcting for multiple comparisons.
+
+    # Parameters
+    # data = dataset with client information and experiment variation, like final_rooster_process_counts_profile.
+    # tests = list of (evaluator, stat_test) pairs, for example [('age', 't-test'), ('gender', 'chi-test')]. See all_demographic_tests().
+    # alpha = the probability of rejecting the null hypothesis when it is actually true. The most common value is 0.05.
+    # correction = multiple comparison correction, any method of statsmodels multipletests ('holm', 'bonferroni', 'fdr_bh', ...). Use None for no correction.
+    # event_data = web data with process steps, like web_group_experiment, used by the z-tests. Default is None which uses data.
+    # n_jobs = number of worker processes. Default is 1 which runs in the current process: each test takes milliseconds, so starting a
+    #          process pool usually costs more than it saves. Use None to use every CPU for large batteries or large datasets.
+
+    if event_data is None:
+        event_data = data
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    n_jobs = max(1, min(n_jobs, len(tests)))
+
+    if n_jobs == 1:
+        set_worker_data(data, event_data)
+        try:
+            results = [run_worker_test(evaluator, stat_test, alpha) for evaluator, stat_test in tests]
+        finally:
+            worker_data.clear()
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=set_worker_data, initargs=(data, event_data)) as pool:
+            futures = [pool.submit(run_worker_test, evaluator, stat_test, alpha) for evaluator, stat_test in tests]
+            results = [future.result() for future in futures]
+
+    results = pd.DataFrame(results, columns=['evaluator', 'stat_test', 'column', 'statistic', 'p_value', 'alpha', 'reject', 'hypothesis'])
+
+    # Corrects the p-values for running many tests at once. Without it, the chance of at least one false positive grows with the number of tests.
+    if correction is not None and len(results) > 0:
+        reject_adjusted, p_value_adjusted, _, _ = multipletests(results['p_value'], alpha=alpha, method=correction)
+        results['p_value_adjusted'] = p_value_adjusted
+        results['reject_adjusted'] = reject_adjusted
+        results['correction'] = correction
+
+    return results
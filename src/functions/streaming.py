@@ -0,0 +1,447 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loader import PROCESS_DICT, WEB_DATA_DTYPES, DATE_FORMAT, encode_process_step
+from funnel import FunnelMetrics
+
+
+# Number of steps in the process (start, step_1, step_2, step_3, confirm).
+N_STEPS = len(PROCESS_DICT)
+
+# Names of the step columns, in step order. Same names data_wrangling() gives to client_process_counts.
+STEP_COLUMNS = list(PROCESS_DICT)
+
+# Column with the position of each event in the web data files (pt_1 then pt_2), added by read_web_data_chunks(). It breaks ties
+# between events of a client with the same date_time the way the stable sort of the in-memory functions does.
+ROW_NUMBER = 'row_number'
+
+# Orders of the web data files that stream_web_data() can read:
+#   - 'time': each client's events are in date_time order across the files. Chunks are folded in as they are read.
+#   - 'client': all the events of a client are next to each other in the files, in any date_time order (the raw files list each client's
+#               events newest first). The trailing client of each chunk is held back until the next chunk.
+#   - 'any': no order. The events are first spilled to disk in partitions of clients, then each partition is folded in at once.
+STREAM_ORDERS = ['time', 'client', 'any']
+
+
+def datetime_to_int(date_time):
+    # This function turns a datetime Series into int64 nanoseconds so timestamps can be compared and subtracted with NumPy.
+
+    # Parameters
+    # date_time = Series with datetime values.
+
+    return date_time.to_numpy().astype('datetime64[ns]').astype('int64')
+
+
+class StreamingAggregator:
+    # This class computes the experiment metrics from the web data without keeping the events in memory.
+    # Events are fed in chunks or hourly batches with update(). Every batch is folded into:
+    #   - per-client state: how many times the client was at each step (as in client_process_counts), the client's last step and timestamp,
+    #     and a bitmask of the steps the client reached.
+    #   - per-variation, per-step accumulators with the number of events, backward steps (errors), time spent and clients that reached the step.
+    # Memory depends on the number of clients, not on the number of events. update() only touches the clients in the batch and reading a
+    # metric only reads the accumulators, so both take time proportional to the batch, not to the full history.
+    # The state can be saved with save() and restored with StreamingAggregator.load(), so it survives process restarts.
+    #
+    # Completion rate, drop-off rate and client_process_counts only use the step counts, so the order of the events doesn't matter.
+    # Error rate and time per step compare each event with the previous event of the same client, so each client's events must arrive
+    # in date_time order across batches (the order inside a batch doesn't matter). update() raises a ValueError if they don't.
+    # stream_web_data() can regroup the files so all the events of a client are in one batch, for files in any order (see STREAM_ORDERS).
+    # Events of a client with the same date_time are ordered by their row_number column (see read_web_data_chunks()), so ties are broken
+    # by file order as in backend.py, and a tie that arrives after a later row of the file raises a ValueError too. Without row_number,
+    # ties are ordered by arrival, so tied events split across batches must arrive in file order.
+    #
+    # The results are the same as running data_wrangling() and the functions in backend.py on the full web data.
+
+    def __init__(self, experiment_roster):
+        # Parameters
+        # experiment_roster = dataset with client_id and Variation, as returned by load_data().
+
+        roster = experiment_roster.dropna(subset=['Variation'])
+
+        # Variations sorted so their position in the accumulators is always the same.
+        self.variations = sorted(roster['Variation'].unique())
+
+        # Lookup table from client_id to the position of its variation in self.variations.
+        self.variation_codes = pd.Series(pd.Categorical(roster['Variation'], categories=self.variations).codes,
+                                         index=roster['client_id'].values)
+
+        # Per-client state, one row per client. client_rows maps a client_id to its row. The arrays grow as new clients arrive.
+        self.client_rows = {}
+        self.n_clients = 0
+        self.client_ids = np.zeros(0, dtype='int64')
+        self.client_variations = np.zeros(0, dtype='int8')
+        self.step_counts = np.zeros((0, N_STEPS), dtype='int64')
+        self.last_steps = np.zeros(0, dtype='int8')
+        self.last_times = np.zeros(0, dtype='int64')
+        self.last_row_numbers = np.zeros(0, dtype='int64')
+
+        # Bit n is set when the client reached step n. uint8 is enough for the five steps.
+        self.reached = np.zeros(0, dtype='uint8')
+
+        # Per-variation, per-step accumulators. Only clients that are part of the experiment are counted.
+        shape = (len(self.variations), N_STEPS)
+        self.event_counts = np.zeros(shape, dtype='int64')
+        self.error_counts = np.zeros(shape, dtype='int64')
+        self.time_sums = np.zeros(shape, dtype='int64')
+        self.time_counts = np.zeros(shape, dtype='int64')
+        self.reached_counts = np.zeros(shape, dtype='int64')
+        self.client_counts = np.zeros(len(self.variations), dtype='int64')
+
+    def lookup_variation(self, client_ids):
+        # Returns the position of the variation of each client, or -1 for clients that are not part of the experiment.
+
+        return self.variation_codes.reindex(client_ids).fillna(-1).to_numpy().astype('int64')
+
+    def grow(self, n_clients):
+        # Makes the per-client arrays big enough for n_clients. The capacity is doubled so adding clients one batch at a time stays cheap.
+
+        capacity = len(self.client_ids)
+        if n_clients <= capacity:
+            return
+
+        capacity = max(n_clients, 2 * capacity, 1024)
+        for name in ['client_ids', 'client_variations', 'step_counts', 'last_steps', 'last_times', 'last_row_numbers', 'reached']:
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def find_rows(self, client_ids):
+        # Returns the row of each client in the per-client arrays, or -1 for clients that were never seen.
+
+        # Parameters
+        # client_ids = array of unique client ids.
+
+        return np.fromiter((self.client_rows.get(client_id, -1) for client_id in client_ids.tolist()), dtype='int64',
+                           count=len(client_ids))
+
+    def add_clients(self, client_ids, rows):
+        # Gives a new row to the clients seen for the first time (row -1) and returns the rows of all clients.
+
+        # Parameters
+        # client_ids = array of unique client ids.
+        # rows = rows returned by find_rows() for those clients.
+
+        new_clients = rows < 0
+        if not new_clients.any():
+            return rows
+
+        new_ids = client_ids[new_clients]
+        new_rows = np.arange(self.n_clients, self.n_clients + len(new_ids))
+        self.grow(self.n_clients + len(new_ids))
+
+        self.client_rows.update(zip(new_ids.tolist(), new_rows.tolist()))
+        self.client_ids[new_rows] = new_ids
+        self.last_steps[new_rows] = -1
+        self.last_row_numbers[new_rows] = -1
+
+        # The variation of a client is fixed the first time it's seen. Experiment clients are added to the client counts.
+        variations = self.lookup_variation(new_ids)
+        self.client_variations[new_rows] = variations
+        self.client_counts += np.bincount(variations[variations >= 0], minlength=len(self.variations))
+
+        rows = rows.copy()
+        rows[new_clients] = new_rows
+        self.n_clients += len(new_ids)
+
+        return rows
+
+    def update(self, chunk):
+        # This method folds a chunk (or a batch of new events) of web data into the aggregates.
+
+        # Parameters
+        # chunk = dataframe with client_id, process_step (numerical, 0-4), date_time and optionally row_number.
+
+        if chunk.empty:
+            return self
+
+        # Sorts values by client_id and date_time, as the metric functions in backend.py do. Ties are broken by row_number if the chunk has it.
+        has_row_numbers = ROW_NUMBER in chunk.columns
+        chunk = chunk.sort_values(by=['client_id', 'date_time'] + ([ROW_NUMBER] if has_row_numbers else []))
+
+        client_ids = chunk['client_id'].to_numpy()
+        steps = chunk['process_step'].to_numpy().astype('int64')
+        times = datetime_to_int(chunk['date_time'])
+        row_numbers = chunk[ROW_NUMBER].to_numpy().astype('int64') if has_row_numbers else np.full(len(chunk), -1, dtype='int64')
+
+        # Marks the first and last event of each client in the chunk.
+        first_rows = np.flatnonzero(np.r_[True, client_ids[1:] != client_ids[:-1]])
+        last_rows = np.r_[first_rows[1:] - 1, len(client_ids) - 1]
+        events_per_client = np.diff(np.r_[first_rows, len(client_ids)])
+        rows = self.find_rows(client_ids[first_rows])
+        known_clients = rows >= 0
+
+        # Previous step and timestamp of every event. For the first event of a client in the chunk they come from the client's state.
+        previous_steps = np.r_[-1, steps[:-1]]
+        previous_times = np.r_[0, times[:-1]]
+        previous_steps[first_rows] = -1
+        previous_steps[first_rows[known_clients]] = self.last_steps[rows[known_clients]]
+        previous_times[first_rows[known_clients]] = self.last_times[rows[known_clients]]
+        has_previous = previous_steps >= 0
+
+        # The earlier events of a client are already folded in, so a client's new events can't be older than its last one.
+        # With row numbers on both sides, an event with the same timestamp can't come from an earlier row either.
+        first_times = times[first_rows]
+        previous_first_times = previous_times[first_rows]
+        last_row_numbers = np.full(len(first_rows), -1, dtype='int64')
+        last_row_numbers[known_clients] = self.last_row_numbers[rows[known_clients]]
+        tied_earlier_row = ((first_times == previous_first_times) & (last_row_numbers >= 0) & (row_numbers[first_rows] >= 0)
+                            & (row_numbers[first_rows] < last_row_numbers))
+        out_of_order = has_previous[first_rows] & ((first_times < previous_first_times) | tied_earlier_row)
+        if out_of_order.any():
+            raise ValueError(f"Events for client {client_ids[first_rows][out_of_order][0]} arrived out of date_time order. "
+                             "Error rate and time per step need each client's events in date_time order across chunks.")
+
+        # The chunk is valid, so the new clients can be added to the state.
+        rows = self.add_clients(client_ids[first_rows], rows)
+
+        # An error is going from a further step back to a past step, as in error_rate().
+        errors = has_previous & (previous_steps > steps)
+        time_diffs = np.where(has_previous, times - previous_times, 0)
+
+        # Adds the events of experiment clients to the per-variation, per-step accumulators.
+        client_variations = self.client_variations[rows].astype('int64')
+        variations = np.repeat(client_variations, events_per_client)
+        in_experiment = variations >= 0
+        cells = variations[in_experiment] * N_STEPS + steps[in_experiment]
+        size = len(self.variations) * N_STEPS
+        shape = self.event_counts.shape
+
+        self.event_counts += np.bincount(cells, minlength=size).reshape(shape)
+        self.error_counts += np.bincount(cells, weights=errors[in_experiment], minlength=size).astype('int64').reshape(shape)
+        self.time_counts += np.bincount(cells, weights=has_previous[in_experiment], minlength=size).astype('int64').reshape(shape)
+
+        # Time sums are added with np.add.at instead of bincount so they stay exact int64 nanoseconds.
+        time_sums = np.zeros(size, dtype='int64')
+        np.add.at(time_sums, cells, time_diffs[in_experiment])
+        self.time_sums += time_sums.reshape(shape)
+
+        # Counts how many times each client was at each step in the chunk.
+        client_positions = np.repeat(np.arange(len(first_rows)), events_per_client)
+        self.step_counts[rows] += np.bincount(client_positions * N_STEPS + steps,
+                                              minlength=len(first_rows) * N_STEPS).reshape(-1, N_STEPS)
+
+        # Steps reached for the first time add the client to the reached counts of its variation.
+        chunk_reached = np.bitwise_or.reduceat(np.left_shift(1, steps).astype('uint8'), first_rows)
+        newly_reached = chunk_reached & ~self.reached[rows]
+        self.reached[rows] |= chunk_reached
+
+        experiment_clients = client_variations >= 0
+        newly_reached_steps = (newly_reached[experiment_clients, None] >> np.arange(N_STEPS)) & 1
+        np.add.at(self.reached_counts, client_variations[experiment_clients], newly_reached_steps.astype('int64'))
+
+        self.last_steps[rows] = steps[last_rows]
+        self.last_times[rows] = times[last_rows]
+        self.last_row_numbers[rows] = row_numbers[last_rows]
+
+        return self
+
+    def client_process_counts(self):
+        # Returns how many times each client was at each step. Same as the client_process_counts returned by data_wrangling().
+
+        order = np.argsort(self.client_ids[:self.n_clients])
+        counts = pd.DataFrame(self.step_counts[order], index=pd.Index(self.client_ids[order], name='client_id'),
+                              columns=STEP_COLUMNS)
+
+        # Keeps only the steps that appeared in the data, as value_counts().unstack() does.
+        counts = counts.loc[:, counts.sum() > 0]
+        counts.columns.name = 'process_step'
+
+        return counts
+
+    def funnel_metrics(self):
+        # Returns a FunnelMetrics built from the accumulators, so the metrics below are computed by the same code as the in-memory
+        # engine. The accumulators are not copied, so it's cheap to call after every update().
+
+        counts = {'n_steps': N_STEPS, 'event_counts': self.event_counts, 'error_counts': self.error_counts,
+                  'time_counts': self.time_counts, 'time_sums': self.time_sums, 'reached_counts': self.reached_counts,
+                  'client_counts': self.client_counts}
+
+        return FunnelMetrics.from_counts(self.variations, counts)
+
+    def completion_rate(self, variation=None):
+        # Same as calculate_completion_rate(web_group_experiment, variation).
+
+        return self.funnel_metrics().completion_rate(variation)
+
+    def drop_off_rate(self, variation=None):
+        # Same as drop_off_rate(web_group_experiment, variation).
+
+        return self.funnel_metrics().drop_off_rate(variation)
+
+    def error_rate(self, variation=None):
+        # Same as error_rate(web_group_experiment, variation).
+
+        return self.funnel_metrics().error_rate(variation)
+
+    def avg_time_per_step(self, variation=None):
+        # Same as calculate_avg_time_per_step(web_group_experiment, variation). Variation can be 'Control', 'Test', 'Overall' or None for all three.
+
+        return self.funnel_metrics().avg_time_per_step(variation)
+
+    def save(self, path):
+        # This method saves the state to a .npz snapshot so it can be restored with StreamingAggregator.load().
+
+        # Parameters
+        # path = path of the snapshot file.
+
+        n = self.n_clients
+        snapshot = {'variations': np.array(self.variations, dtype=str),
+                    'roster_client_ids': self.variation_codes.index.to_numpy(),
+                    'roster_variation_codes': self.variation_codes.to_numpy(),
+                    'client_ids': self.client_ids[:n], 'client_variations': self.client_variations[:n],
+                    'step_counts': self.step_counts[:n], 'last_steps': self.last_steps[:n],
+                    'last_times': self.last_times[:n], 'last_row_numbers': self.last_row_numbers[:n], 'reached': self.reached[:n],
+                    'event_counts': self.event_counts, 'error_counts': self.error_counts, 'time_sums': self.time_sums,
+                    'time_counts': self.time_counts, 'reached_counts': self.reached_counts, 'client_counts': self.client_counts}
+
+        # Writes to a temporary file first so a crash while saving never corrupts the last good snapshot.
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.savez_compressed(file, **snapshot)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        # This method restores a StreamingAggregator saved with save().
+
+        # Parameters
+        # path = path of the snapshot file.
+
+        with np.load(path) as snapshot:
+            variations = snapshot['variations'].tolist()
+            roster = pd.DataFrame({'client_id': snapshot['roster_client_ids'],
+                                   'Variation': np.array(variations, dtype=object)[snapshot['roster_variation_codes']]})
+            aggregator = cls(roster)
+
+            n = len(snapshot['client_ids'])
+            aggregator.grow(n)
+            aggregator.n_clients = n
+            for name in ['client_ids', 'client_variations', 'step_counts', 'last_steps', 'last_times', 'reached']:
+                getattr(aggregator, name)[:n] = snapshot[name]
+
+            # Snapshots saved before row numbers were tracked don't have them.
+            aggregator.last_row_numbers[:n] = snapshot['last_row_numbers'] if 'last_row_numbers' in snapshot else -1
+            aggregator.client_rows = dict(zip(snapshot['client_ids'].tolist(), range(n)))
+
+            for name in ['event_counts', 'error_counts', 'time_sums', 'time_counts', 'reached_counts', 'client_counts']:
+                setattr(aggregator, name, snapshot[name].copy())
+
+        return aggregator
+
+
+def read_web_data_chunks(paths, chunksize=1_000_000):
+    # This function reads the web data files chunk by chunk. The process steps are turned into numbers as they are read, and each event
+    # gets its row_number: its position in the files, counted across all of them in the order given.
+
+    # Parameters
+    # paths = list of paths to the web data CSVs (pt_1 and pt_2).
+    # chunksize = number of rows per chunk.
+
+    row_number = 0
+
+    for path in paths:
+        reader = pd.read_csv(path, dtype=WEB_DATA_DTYPES, usecols=['client_id', 'process_step', 'date_time'],
+                             parse_dates=['date_time'], date_format=DATE_FORMAT, chunksize=chunksize)
+        for chunk in reader:
+            chunk['process_step'] = encode_process_step(chunk['process_step'])
+            chunk[ROW_NUMBER] = np.arange(row_number, row_number + len(chunk), dtype='int64')
+            row_number += len(chunk)
+            yield chunk
+
+
+def client_contiguous_chunks(chunks):
+    # This function regroups chunks of web data in which all the events of a client are next to each other, so every client is in one
+    # chunk only. The rows of the last client of each chunk are held back and put in front of the next chunk, since the client's events
+    # may go on there. update() then sees all the events of a client at once and their order in the files doesn't matter.
+
+    # Parameters
+    # chunks = iterable of chunks, like read_web_data_chunks().
+
+    held_back = None
+
+    for chunk in chunks:
+        if held_back is not None:
+            chunk = pd.concat([held_back, chunk], ignore_index=True)
+
+        client_ids = chunk['client_id'].to_numpy()
+        other_clients = np.flatnonzero(client_ids != client_ids[-1])
+        split = other_clients[-1] + 1 if len(other_clients) else 0
+
+        held_back = chunk.iloc[split:]
+        if split > 0:
+            yield chunk.iloc[:split]
+
+    if held_back is not None:
+        yield held_back
+
+
+def partitioned_chunks(chunks, n_partitions=16, spill_dir=None):
+    # This function regroups chunks of web data in any order so every client is in one chunk only. Each chunk is split by a hash of
+    # client_id into n_partitions Parquet files in a temporary folder, then each file is read back as one chunk. The files are deleted
+    # once every partition was read.
+
+    # Parameters
+    # chunks = iterable of chunks, like read_web_data_chunks().
+    # n_partitions = number of partitions. Each partition is read in memory at once, so it holds about 1 / n_partitions of the events.
+    # spill_dir = folder where the temporary folder is made. Default is None which uses the system temporary folder.
+
+    with tempfile.TemporaryDirectory(prefix='web_data_', dir=spill_dir) as folder:
+        paths = [os.path.join(folder, f"partition_{partition}.parquet") for partition in range(n_partitions)]
+        writers = [None] * n_partitions
+
+        try:
+            for chunk in chunks:
+                # Sorts the chunk by partition once and writes each slice. The sort is stable, so the file order is kept.
+                partitions = pd.util.hash_array(chunk['client_id'].to_numpy()) % n_partitions
+                order = np.argsort(partitions, kind='stable')
+                bounds = np.r_[0, np.cumsum(np.bincount(partitions, minlength=n_partitions))]
+                table = pa.Table.from_pandas(chunk.iloc[order], preserve_index=False)
+
+                for partition in np.flatnonzero(np.diff(bounds)):
+                    if writers[partition] is None:
+                        writers[partition] = pq.ParquetWriter(paths[partition], table.schema)
+                    writers[partition].write_table(table.slice(bounds[partition], bounds[partition + 1] - bounds[partition]))
+        finally:
+            for writer in writers:
+                if writer is not None:
+                    writer.close()
+
+        for path, writer in zip(paths, writers):
+            if writer is not None:
+                yield pd.read_parquet(path)
+
+
+def stream_web_data(paths, experiment_roster, chunksize=1_000_000, aggregator=None, order='any', n_partitions=16, spill_dir=None):
+    # This function is the streaming version of load_data() + data_wrangling() for the web data. It reads the files in chunks and returns a StreamingAggregator with the metrics.
+
+    # Parameters
+    # paths = list of paths to the web data CSVs (pt_1 and pt_2).
+    # experiment_roster = dataset with client_id and Variation.
+    # chunksize = number of rows per chunk. Peak memory grows with it.
+    # aggregator = StreamingAggregator to continue from, for example one restored with StreamingAggregator.load(). Default is None which starts from scratch.
+    # order = order of the events in the files, one of STREAM_ORDERS. Default is 'any' which works for every file, at the cost of
+    #         writing the events to disk once. Use 'client' for the raw files (faster, no disk), or 'time' when each client's events are
+    #         in date_time order across the files.
+    # n_partitions, spill_dir = see partitioned_chunks(). Only used with order='any'.
+
+    if order not in STREAM_ORDERS:
+        raise ValueError(f"order must be one of {STREAM_ORDERS}, got {order!r}.")
+
+    if aggregator is None:
+        aggregator = StreamingAggregator(experiment_roster)
+
+    chunks = read_web_data_chunks(paths, chunksize)
+
+    if order == 'client':
+        chunks = client_contiguous_chunks(chunks)
+    elif order == 'any':
+        chunks = partitioned_chunks(chunks, n_partitions, spill_dir)
+
+    for chunk in chunks:
+        aggregator.update(chunk)
+
+    return aggregator
@@ -0,0 +1,246 @@
+import os
+import numpy as np
+import pandas as pd
+from loader import RAW_FILES, STEP_NAMES, DATE_FORMAT
+
+
+# Probability of going from each step (rows: start, step_1, step_2, step_3, confirm) to each step or leaving the session (last column),
+# for each variation. Clients that aren't in the experiment use the Control process. Calibrated so the share of clients that reach
+# each step and the number of visits per step are close to the real data (about 99%, 87%, 81%, 76% and 68% of clients reach each step).
+EXIT = 5
+
+TRANSITIONS = {'Control': np.array([[0.04, 0.78, 0.00, 0.00, 0.00, 0.18],
+                                    [0.05, 0.02, 0.82, 0.00, 0.00, 0.11],
+                                    [0.02, 0.03, 0.02, 0.85, 0.00, 0.08],
+                                    [0.02, 0.01, 0.03, 0.02, 0.85, 0.07],
+                                    [0.01, 0.00, 0.00, 0.00, 0.07, 0.92]]),
+               'Test': np.array([[0.04, 0.80, 0.00, 0.00, 0.00, 0.16],
+                                 [0.06, 0.03, 0.81, 0.00, 0.00, 0.10],
+                                 [0.02, 0.04, 0.02, 0.86, 0.00, 0.06],
+                                 [0.02, 0.02, 0.04, 0.02, 0.85, 0.05],
+                                 [0.01, 0.00, 0.00, 0.00, 0.09, 0.90]])}
+
+# Median and spread (sigma of the log) of the seconds spent before getting to each step, inside a session.
+STEP_SECONDS_MEDIAN = np.array([30.0, 25.0, 35.0, 75.0, 95.0])
+STEP_SECONDS_SIGMA = 1.1
+
+# Sessions: every client has 1 + Poisson(EXTRA_SESSIONS) sessions, separated by exponential gaps.
+EXTRA_SESSIONS = 0.6
+SESSION_GAP_DAYS = 3.0
+MAX_EVENTS_PER_SESSION = 40
+
+# Experiment window, 3/15/2017 to 6/20/2017.
+START_DATE = pd.Timestamp('2017-03-15')
+EXPERIMENT_DAYS = 97
+
+# Share of clients in each variation. The rest aren't part of the experiment and are left out of the roster.
+VARIATION_SHARES = {'Test': 0.38, 'Control': 0.33}
+
+# Demographic mix of df_final_demo.csv.
+GENDER_SHARES = {'U': 0.342, 'M': 0.336, 'F': 0.322}
+MISSING_PROFILE_SHARE = 0.0002
+
+
+def generate_clients(n_clients, rng, first_client_id=0):
+    # This function simulates client_profiles and experiment_roster for n_clients clients, with the columns and types of load_local_data().
+    # Returns client_profiles, experiment_roster (only the clients in the experiment, as loaded) and the variation of every client ('' if
+    # the client isn't in the experiment).
+
+    # Parameters
+    # n_clients = number of clients.
+    # rng = numpy random Generator.
+    # first_client_id = client_id of the first client. Ids are consecutive so blocks of clients never share ids.
+
+    client_ids = np.arange(first_client_id, first_client_id + n_clients, dtype='int64')
+
+    tenure_months = np.clip(rng.gamma(2.2, 68, n_clients), 33, 749).round()
+    age = np.clip(rng.normal(46.4, 15.6, n_clients), 13.5, 96).round() + rng.choice([0, 0.5], n_clients)
+    calls = rng.integers(0, 8, n_clients).astype('float64')
+
+    client_profiles = pd.DataFrame({'client_id': client_ids,
+                                    'clnt_tenure_yr': tenure_months // 12,
+                                    'clnt_tenure_mnth': tenure_months,
+                                    'clnt_age': age,
+                                    'gendr': rng.choice(list(GENDER_SHARES), n_clients, p=list(GENDER_SHARES.values())).astype(object),
+                                    'num_accts': np.clip(rng.poisson(0.3, n_clients) + 2, 1, 8).astype('float64'),
+                                    'bal': np.round(rng.lognormal(11.1, 1.1, n_clients), 2),
+                                    'calls_6_mnth': calls,
+                                    # Logins follow calls in the real data, logons_6_mnth is calls_6_mnth + 3 for most clients.
+                                    'logons_6_mnth': np.clip(calls + 3 + rng.choice([0, 0, 0, 1, -1], n_clients), 3, 9)})
+
+    # A few clients have no profile data, as in df_final_demo.csv.
+    missing = rng.random(n_clients) < MISSING_PROFILE_SHARE
+    client_profiles.loc[missing, client_profiles.columns[1:]] = np.nan
+
+    shares = list(VARIATION_SHARES.values())
+    variations = rng.choice(list(VARIATION_SHARES) + [''], n_clients, p=shares + [1 - sum(shares)]).astype(object)
+    in_experiment = variations != ''
+    experiment_roster = pd.DataFrame({'client_id': client_ids[in_experiment],
+                                      'Variation': pd.Categorical(variations[in_experiment], categories=sorted(VARIATION_SHARES))})
+
+    return client_profiles, experiment_roster, variations
+
+
+def simulate_sessions(session_variations, rng):
+    # This function walks every session through the funnel at once, one step per iteration, with the transition probabilities of its
+    # variation. Returns the session and the step of every event, ordered by session.
+
+    # Parameters
+    # session_variations = int array with the row of the variation of every session in the stacked transitions (0 Control, 1 Test).
+    # rng = numpy random Generator.
+
+    cumulative = np.cumsum(np.stack([TRANSITIONS['Control'], TRANSITIONS['Test']]), axis=2)
+
+    sessions = np.arange(len(session_variations))
+    steps = np.zeros(len(session_variations), dtype='int8')
+    event_sessions, event_steps = [], []
+
+    for _ in range(MAX_EVENTS_PER_SESSION):
+        event_sessions.append(sessions)
+        event_steps.append(steps)
+
+        draws = rng.random(len(sessions))
+        next_steps = (draws[:, None] > cumulative[session_variations[sessions], steps]).sum(axis=1)
+
+        keep = next_steps != EXIT
+        sessions, steps = sessions[keep], next_steps[keep].astype('int8')
+        if len(sessions) == 0:
+            break
+
+    event_sessions = np.concatenate(event_sessions)
+    event_steps = np.concatenate(event_steps)
+    order = np.argsort(event_sessions, kind='stable')
+
+    return event_sessions[order], event_steps[order]
+
+
+def generate_web_data(client_ids, variations, rng):
+    # This function simulates the web data of the given clients, with the columns and types of web_group from load_local_data().
+    # Every client has one or more sessions separated by gaps of days. Each session starts at 'start' and moves through the funnel with
+    # forward steps, backward steps (errors), repeated steps and exits.
+
+    # Parameters
+    # client_ids = int array with the client ids.
+    # variations = array with the variation of every client ('' if the client isn't in the experiment).
+    # rng = numpy random Generator.
+
+    n_sessions = 1 + rng.poisson(EXTRA_SESSIONS, len(client_ids))
+    session_clients = np.repeat(np.arange(len(client_ids)), n_sessions)
+    first_session = np.r_[True, session_clients[1:] != session_clients[:-1]]
+
+    # Start of every session: the first one anywhere in the window, the next ones after exponential gaps.
+    gaps = np.where(first_session, 0, rng.exponential(SESSION_GAP_DAYS * 86400, len(session_clients)))
+    first_starts = rng.uniform(0, EXPERIMENT_DAYS * 86400, len(client_ids))
+    cumulative_gaps = np.cumsum(gaps)
+    session_starts = first_starts[session_clients] + cumulative_gaps - cumulative_gaps[np.flatnonzero(first_session)][session_clients]
+
+    session_variations = (variations[session_clients] == 'Test').astype('int64')
+    event_sessions, event_steps = simulate_sessions(session_variations, rng)
+
+    # Time of every event: start of its session plus the time spent before each of its steps.
+    first_event = np.r_[True, event_sessions[1:] != event_sessions[:-1]]
+    durations = rng.lognormal(np.log(STEP_SECONDS_MEDIAN[event_steps]), STEP_SECONDS_SIGMA)
+    durations[first_event] = 0
+    cumulative_durations = np.cumsum(durations)
+    session_offsets = cumulative_durations - cumulative_durations[np.flatnonzero(first_event)][np.cumsum(first_event) - 1]
+    seconds = np.round(session_starts[event_sessions] + session_offsets)
+
+    # The ids are made as text once per client and once per session, then repeated for their events.
+    client_text = pd.Series(client_ids).astype(str)
+    visitor_ids = (client_text + '_' + pd.Series(client_ids % 97).astype(str)).to_numpy(dtype=object)
+    session_numbers = np.arange(len(session_clients)) - np.flatnonzero(first_session)[session_clients]
+    visit_ids = (client_text.iloc[session_clients].reset_index(drop=True) + '_' + pd.Series(session_numbers).astype(str)).to_numpy(dtype=object)
+
+    event_clients = session_clients[event_sessions]
+    web_group = pd.DataFrame({'client_id': client_ids[event_clients],
+                              'visitor_id': visitor_ids[event_clients],
+                              'visit_id': visit_ids[event_sessions],
+                              'process_step': event_steps,
+                              'date_time': (START_DATE + pd.to_timedelta(seconds, unit='s')).to_numpy().astype('datetime64[ns]')})
+
+    return web_group
+
+
+def generate_blocks(n_clients, block_size=1_000_000, seed=0):
+    # This function simulates the three datasets in blocks of clients, so data of any size can be made without holding it in memory.
+    # Yields client_profiles, experiment_roster and web_group for each block. Each block has its own random stream spawned from seed,
+    # so the same seed and block_size always give the same data.
+
+    # Parameters
+    # n_clients = total number of clients. There are about 7-8 events per client.
+    # block_size = number of clients in each block.
+    # seed = seed of the simulated data.
+
+    n_blocks = -(-n_clients // block_size)
+
+    for block, block_seed in enumerate(np.random.SeedSequence(seed).spawn(n_blocks)):
+        rng = np.random.default_rng(block_seed)
+        first_client_id = block * block_size
+        block_clients = min(block_size, n_clients - first_client_id)
+
+        client_profiles, experiment_roster, variations = generate_clients(block_clients, rng, first_client_id)
+        web_group = generate_web_data(client_profiles['client_id'].to_numpy(), variations, rng)
+
+        yield client_profiles, experiment_roster, web_group
+
+
+def generate_data(n_clients, block_size=1_000_000, seed=0):
+    # This function returns simulated client_profiles, experiment_roster and web_group in memory, like load_local_data().
+
+    # Parameters
+    # n_clients = number of clients. There are about 7-8 events per client.
+    # block_size, seed = see generate_blocks().
+
+    blocks = list(zip(*generate_blocks(n_clients, block_size, seed)))
+
+    return tuple(pd.concat(frames, ignore_index=True) for frames in blocks)
+
+
+def write_data(output_dir, n_clients, block_size=1_000_000, seed=0):
+    # This function writes simulated data to Parquet files, one file per dataset and block, and returns the paths of each dataset.
+    # The lists of paths can be given straight to DuckDBBackend, which reads them in order.
+
+    # Parameters
+    # output_dir = folder where the Parquet files are written.
+    # n_clients = number of clients. There are about 7-8 events per client, so 130 million clients are about 1 billion events.
+    # block_size, seed = see generate_blocks().
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {'client_profiles': [], 'experiment_roster': [], 'web_group': []}
+
+    for block, frames in enumerate(generate_blocks(n_clients, block_size, seed)):
+        for name, frame in zip(paths, frames):
+            path = os.path.join(output_dir, f"{name}-{block:05d}.parquet")
+            frame.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+            paths[name].append(path)
+
+    return paths
+
+
+def write_raw_data(output_dir, n_clients, seed=0):
+    # This function writes simulated data as the four raw CSV files of data/raw (see RAW_FILES in loader.py), with the step names and
+    # the date format of the real files, so load_data(data_dir=output_dir) and the streaming functions can read them. The web data is split
+    # in two halves, pt_1 and pt_2. Returns the folder.
+
+    # Parameters
+    # output_dir = folder where the CSV files are written.
+    # n_clients = number of clients.
+    # seed = seed of the random number generator.
+
+    os.makedirs(output_dir, exist_ok=True)
+    client_profiles, experiment_roster, web_group = generate_data(n_clients, seed=seed)
+
+    web_group = web_group.assign(process_step=web_group['process_step'].map(STEP_NAMES),
+                                 date_time=web_group['date_time'].dt.strftime(DATE_FORMAT))
+    half = len(web_group) // 2
+
+    frames = {'client_profiles': client_profiles, 'web_data_pt1': web_group.iloc[:half], 'web_data_pt2': web_group.iloc[half:],
+              'experiment_roster': experiment_roster}
+
+    for name, frame in frames.items():
+        path = os.path.join(output_dir, RAW_FILES[name])
+        frame.to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    return output_dir
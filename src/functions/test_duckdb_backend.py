@@ -0,0 +1,55 @@
+import os
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+import backend
+from conftest import VARIATIONS
+
+duckdb_backend = pytest.importorskip('duckdb_backend')
+
+
+# Regression checks of DuckDBBackend against the functions in backend.py, which are the reference.
+
+
+@pytest.fixture(scope='module')
+def engine():
+    with duckdb_backend.DuckDBBackend(threads=1) as engine:
+        yield engine
+
+
+def test_metrics_match_backend(engine, web_data):
+    for variation in VARIATIONS:
+        assert engine.calculate_completion_rate(web_data, variation) == pytest.approx(backend.calculate_completion_rate(web_data, variation))
+
+        total_errors, total_steps, error_rate, average_error_per_step = engine.error_rate(web_data, variation)
+        expected = backend.error_rate(web_data, variation)
+        assert (total_errors, total_steps) == (expected[0], expected[1])
+        assert error_rate == pytest.approx(expected[2])
+        assert_series_equal(average_error_per_step, expected[3], check_dtype=False, check_index_type=False)
+
+        assert_frame_equal(engine.drop_off_rate(web_data, variation), backend.drop_off_rate(web_data, variation), check_dtype=False)
+
+    # Time per step is compared exactly, to the nanosecond.
+    for variation in ['Control', 'Test', 'Overall']:
+        assert_series_equal(engine.calculate_avg_time_per_step(web_data, variation),
+                            backend.calculate_avg_time_per_step(web_data, variation))
+
+
+def test_data_wrangling_matches_backend(engine, frames):
+    client_profiles, experiment_roster, web_group = frames
+
+    for result, expected in zip(engine.data_wrangling(web_group, experiment_roster, client_profiles),
+                                backend.data_wrangling(web_group, experiment_roster, client_profiles)):
+        assert_frame_equal(result, expected)
+
+
+def test_close_removes_own_temp_directory(tmp_path):
+    with duckdb_backend.DuckDBBackend(threads=1) as engine:
+        temp_directory = engine.temp_directory
+        assert os.path.isdir(temp_directory)
+    assert not os.path.exists(temp_directory)
+
+    # A folder given by the caller is kept.
+    engine = duckdb_backend.DuckDBBackend(temp_directory=str(tmp_path / 'spill'), threads=1)
+    engine.close()
+    engine.close()
+    assert os.path.isdir(tmp_path / 'spill')
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+import backend
+from conftest import VARIATIONS
+from funnel import FunnelMetrics
+from sharding import sharded_funnel_metrics
+from transitions import TransitionMatrix
+
+
+# Regression checks of the engines built on funnel_counts() against the functions in backend.py, which are the reference.
+
+
+@pytest.fixture(scope='module')
+def unfinished_data(web_data):
+    # The same data without any 'confirm' event, so nobody completed.
+
+    return web_data[web_data['process_step'] != 4].reset_index(drop=True)
+
+
+def assert_same_metrics(metrics, data):
+    # Checks every metric of a FunnelMetrics against the backend functions, for every variation and overall.
+
+    for variation in VARIATIONS:
+        assert metrics.completion_rate(variation) == pytest.approx(backend.calculate_completion_rate(data, variation))
+
+        total_errors, total_steps, error_rate, average_error_per_step = metrics.error_rate(variation)
+        expected = backend.error_rate(data, variation)
+        assert (total_errors, total_steps) == (expected[0], expected[1])
+        assert error_rate == pytest.approx(expected[2])
+        assert_series_equal(average_error_per_step, expected[3], check_dtype=False, check_index_type=False)
+
+        assert_frame_equal(metrics.drop_off_rate(variation), backend.drop_off_rate(data, variation), check_dtype=False)
+
+    for variation in ['Control', 'Test', 'Overall']:
+        assert_series_equal(metrics.avg_time_per_step(variation), backend.calculate_avg_time_per_step(data, variation),
+                            check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize('dataset', ['web_data', 'unfinished_data'])
+def test_funnel_metrics_match_backend(dataset, request):
+    data = request.getfixturevalue(dataset)
+
+    assert_same_metrics(FunnelMetrics(data), data)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sharded_funnel_metrics_match_backend(web_data, n_jobs):
+    assert_same_metrics(sharded_funnel_metrics(web_data, n_jobs=n_jobs, n_shards=5), web_data)
+
+
+def test_completion_rate_without_confirm(unfinished_data):
+    assert FunnelMetrics(unfinished_data).completion_rate() == 0
+    assert sharded_funnel_metrics(unfinished_data, n_jobs=1).completion_rate('Test') == 0
+
+
+def test_transition_matrix_matches_pandas(web_data):
+    # backend.error_rate() runs on TransitionMatrix, so the errors are checked against the original pandas computation: a step lower
+    # than the previous step of the same client, with the events sorted by client_id and date_time.
+    matrix = TransitionMatrix(web_data)
+
+    for variation in ['Control', 'Test']:
+        events = web_data[web_data['Variation'] == variation].sort_values(by=['client_id', 'date_time'])
+        previous_steps = events.groupby('client_id')['process_step'].shift()
+        errors = (previous_steps > events['process_step']).groupby(events['process_step']).sum()
+
+        total_errors, total_steps, error_rate, average_error_per_step = matrix.error_rate(variation)
+        assert total_errors == errors.sum()
+        assert total_steps == len(events)
+        assert_series_equal(average_error_per_step, errors / events['process_step'].value_counts().sort_index() * 100,
+                            check_dtype=False, check_index_type=False, check_names=False)
+
+        assert_frame_equal(matrix.drop_off_rate(variation), backend.drop_off_rate(web_data, variation), check_dtype=False)
+
+
+def test_sharded_transitions_match(web_data):
+    counts = FunnelMetrics(web_data)
+    sharded = sharded_funnel_metrics(web_data, n_jobs=1, n_shards=5)
+
+    np.testing.assert_array_equal(sharded.transitions, counts.transitions)
+    np.testing.assert_array_equal(sharded.first_transitions, counts.first_transitions)
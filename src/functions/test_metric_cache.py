@@ -0,0 +1,69 @@
+import pytest
+import backend
+from metric_cache import METRIC_COLUMNS, MetricCache
+
+
+# Checks of MetricCache: results are reused only for frames with the same content and arguments, and match backend.py.
+
+
+def test_hit_and_miss(web_data):
+    cache = MetricCache()
+    completion_rate = cache.wrap(backend.calculate_completion_rate, METRIC_COLUMNS)
+
+    assert completion_rate(web_data, 'Test') == backend.calculate_completion_rate(web_data, 'Test')
+    assert completion_rate(web_data.copy(), 'Test') == backend.calculate_completion_rate(web_data, 'Test')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Other arguments, or a frame with other values, are computed again.
+    completion_rate(web_data, 'Control')
+    completion_rate(web_data.iloc[:-1], 'Test')
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+@pytest.mark.parametrize('dtype', [None, object, 'category'])
+def test_in_place_edit(web_data, dtype):
+    web_data = web_data.copy()
+
+    if dtype is not None:
+        # A copy, so the new column owns its memory and can be changed in place.
+        web_data['Variation'] = web_data['Variation'].astype(dtype).copy()
+
+    cache = MetricCache()
+    completion_rate = cache.wrap(backend.calculate_completion_rate, METRIC_COLUMNS)
+    assert completion_rate(web_data, 'Test') > 0
+
+    web_data.loc[web_data['process_step'] == 4, 'process_step'] = 3
+    assert completion_rate(web_data, 'Test') == 0
+
+    web_data.loc[web_data.index[0], 'Variation'] = 'Control' if web_data.loc[web_data.index[0], 'Variation'] == 'Test' else 'Test'
+    completion_rate(web_data, 'Test')
+    assert (cache.hits, cache.misses) == (0, 3)
+
+
+def test_lru_eviction(web_data):
+    cache = MetricCache(maxsize=2)
+    error_rate = cache.wrap(backend.error_rate, METRIC_COLUMNS)
+
+    error_rate(web_data, 'Control')
+    error_rate(web_data, 'Test')
+    error_rate(web_data, 'Control')
+    # 'Test' is now the least recently used result, so it's dropped to make room.
+    error_rate(web_data, None)
+    assert len(cache.results) == 2
+
+    error_rate(web_data, 'Control')
+    assert (cache.hits, cache.misses) == (2, 3)
+    error_rate(web_data, 'Test')
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_disk_round_trip(web_data, tmp_path):
+    drop_off_rate = MetricCache(cache_dir=tmp_path).wrap(backend.drop_off_rate, METRIC_COLUMNS)
+    expected = drop_off_rate(web_data, 'Test')
+
+    # A new cache on the same folder, like after a restart, reads the result from disk.
+    cache = MetricCache(cache_dir=tmp_path)
+    result = cache.call(backend.drop_off_rate, web_data, 'Test', columns=METRIC_COLUMNS)
+
+    assert result.equals(expected)
+    assert (cache.hits, cache.misses) == (1, 0)
@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+import backend
+from conftest import VARIATIONS
+from loader import RAW_FILES, load_local_data
+from streaming import StreamingAggregator, stream_web_data
+from synthetic import write_raw_data
+
+
+# Regression checks of StreamingAggregator against the functions in backend.py, which are the reference.
+
+
+def stream_events(frames, n_chunks=7):
+    # Feeds the web data to a new StreamingAggregator in n_chunks chunks, in date_time order so each client's events arrive in order.
+
+    client_profiles, experiment_roster, web_group = frames
+    events = web_group.sort_values(by='date_time', kind='stable')[['client_id', 'process_step', 'date_time']]
+
+    aggregator = StreamingAggregator(experiment_roster)
+    for chunk in np.array_split(np.arange(len(events)), n_chunks):
+        aggregator.update(events.iloc[chunk])
+
+    return aggregator
+
+
+def assert_same_metrics(aggregator, data):
+    # Checks every metric of a StreamingAggregator against the backend functions, for every variation and overall.
+
+    for variation in VARIATIONS:
+        assert aggregator.completion_rate(variation) == pytest.approx(backend.calculate_completion_rate(data, variation))
+
+        total_errors, total_steps, error_rate, average_error_per_step = aggregator.error_rate(variation)
+        expected = backend.error_rate(data, variation)
+        assert (total_errors, total_steps) == (expected[0], expected[1])
+        assert error_rate == pytest.approx(expected[2])
+        assert_series_equal(average_error_per_step, expected[3], check_dtype=False, check_index_type=False)
+
+        assert_frame_equal(aggregator.drop_off_rate(variation), backend.drop_off_rate(data, variation), check_dtype=False)
+
+    for variation in ['Control', 'Test', 'Overall']:
+        assert_series_equal(aggregator.avg_time_per_step(variation), backend.calculate_avg_time_per_step(data, variation),
+                            check_dtype=False, check_index_type=False)
+
+
+def test_streaming_metrics_match_backend(frames, web_data):
+    assert_same_metrics(stream_events(frames), web_data)
+
+
+def test_save_load_round_trip(frames, web_data, tmp_path):
+    aggregator = stream_events(frames)
+    path = str(tmp_path / 'state.npz')
+    aggregator.save(path)
+
+    restored = StreamingAggregator.load(path)
+
+    assert_frame_equal(restored.client_process_counts(), aggregator.client_process_counts())
+    np.testing.assert_array_equal(restored.last_row_numbers[:restored.n_clients], aggregator.last_row_numbers[:aggregator.n_clients])
+    assert_same_metrics(restored, web_data)
+
+
+def test_load_legacy_snapshot(frames, web_data, tmp_path):
+    # Snapshots saved before row numbers were tracked don't have last_row_numbers. They load with -1 for every client.
+    path = str(tmp_path / 'state.npz')
+    stream_events(frames).save(path)
+
+    with np.load(path) as snapshot:
+        legacy = {name: snapshot[name] for name in snapshot.files if name != 'last_row_numbers'}
+    np.savez_compressed(path, **legacy)
+
+    restored = StreamingAggregator.load(path)
+
+    assert (restored.last_row_numbers[:restored.n_clients] == -1).all()
+    assert_same_metrics(restored, web_data)
+
+
+@pytest.mark.parametrize('layout, order', [('newest_first', 'client'), ('newest_first', 'any'), ('shuffled', 'any'),
+                                           ('oldest_first', 'time')])
+def test_stream_web_data_matches_data_wrangling(tmp_path, layout, order):
+    # Writes the raw files, rewrites the web data in the given layout and streams it in small chunks, so clients span several chunks.
+    data_dir = write_raw_data(str(tmp_path / 'raw'), 300, seed=5)
+    paths = [os.path.join(data_dir, RAW_FILES[name]) for name in ['web_data_pt1', 'web_data_pt2']]
+
+    events = pd.concat([pd.read_csv(path, dtype=str) for path in paths], ignore_index=True)
+    if layout == 'newest_first':
+        events = events.iloc[::-1]
+    elif layout == 'shuffled':
+        events = events.sample(frac=1, random_state=0)
+    half = len(events) // 2
+    events.iloc[:half].to_csv(paths[0], index=False)
+    events.iloc[half:].to_csv(paths[1], index=False)
+
+    client_profiles, experiment_roster, web_group = load_local_data(data_dir, cache_dir=None)
+    # Nanoseconds, like the times of StreamingAggregator. Newer pandas versions parse the dates in microseconds.
+    web_group['date_time'] = web_group['date_time'].astype('datetime64[ns]')
+    client_process_counts, *_, web_group_experiment, client_profile_experiment = backend.data_wrangling(web_group, experiment_roster,
+                                                                                                          client_profiles)
+
+    aggregator = stream_web_data(paths, experiment_roster, chunksize=100, order=order, n_partitions=4, spill_dir=str(tmp_path))
+
+    assert_frame_equal(aggregator.client_process_counts(), client_process_counts, check_dtype=False, check_names=False)
+    assert_same_metrics(aggregator, web_group_experiment)
+    # The spill files are deleted.
+    assert sorted(os.listdir(tmp_path)) == ['raw']
+
+
+def test_stream_web_data_newest_first_in_time_order(tmp_path):
+    data_dir = write_raw_data(str(tmp_path), 50, seed=5)
+    paths = [os.path.join(data_dir, RAW_FILES[name]) for name in ['web_data_pt1', 'web_data_pt2']]
+    events = pd.concat([pd.read_csv(path, dtype=str) for path in paths], ignore_index=True).iloc[::-1]
+    events.to_csv(paths[0], index=False)
+
+    with pytest.raises(ValueError):
+        stream_web_data(paths[:1], load_local_data(data_dir, cache_dir=None)[1], chunksize=100, order='time')
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from loader import STEP_NAMES
+from funnel import funnel_counts, dropoff_from_counts
+
+
+class TransitionMatrix:
+    # This class holds the full step-to-step transition counts of a funnel for every group (variation) and derives the funnel metrics
+    # from them: repeats (diagonal), forward steps and skips (above it) and backtracks (below it, the errors of error_rate()).
+    # The error rate, the error per step and the drop-off rate are the same as the functions in backend.py, and the matrices also give a
+    # Markov chain of the funnel (transition probabilities, expected visits and the probability of reaching each step).
+    #
+    # Usage:
+    #   matrix = TransitionMatrix(web_group_experiment)
+    #   matrix.counts('Test')            -> transition counts of the Test group, entry/steps x steps/exit.
+    #   matrix.error_rate('Test')        -> same as error_rate(web_group_experiment, 'Test').
+    #   matrix.markov('Test')            -> expected visits and reach probability of every step.
+
+    def __init__(self, data, by='Variation'):
+        # Parameters
+        # data = dataset which must contain client_id, process_step (numerical, in funnel order) and date_time, plus the by column.
+        # by = column with the groups. Default is 'Variation'. Use None for a single 'Overall' group.
+
+        if by is None:
+            group_codes = np.zeros(len(data), dtype='int64')
+            self.groups = ['Overall']
+        else:
+            groups = pd.Categorical(data[by].to_numpy())
+            group_codes = groups.codes.astype('int64')
+            self.groups = list(groups.categories)
+
+        # Steps are encoded as their position among the steps in the data, so any numbering works.
+        step_values = data['process_step'].to_numpy()
+        self.steps = np.unique(step_values)
+        self.step_type = data['process_step'].dtype
+        step_codes = np.searchsorted(self.steps, step_values).astype('int64')
+
+        client_codes = pd.factorize(data['client_id'])[0].astype('int64')
+        times = data['date_time'].to_numpy().astype('datetime64[ns]').astype('int64')
+
+        # The transitions are counted by funnel_counts(), the same pass FunnelMetrics uses.
+        self.n_steps = len(self.steps)
+        counts = funnel_counts(group_codes, len(self.groups), client_codes, step_codes, times, self.n_steps)
+        self.transitions, self.first_transitions = counts['transitions'], counts['first_transitions']
+
+    def rows(self, group=None):
+        # Returns the groups of the matrices for a group, or all groups for the overall numbers.
+
+        if group in self.groups:
+            return [self.groups.index(group)]
+
+        return list(range(len(self.groups)))
+
+    def labels(self):
+        # Returns the names of the steps.
+
+        return [STEP_NAMES.get(step, step) for step in self.steps.tolist()]
+
+    def counts(self, group=None, first=False):
+        # This method returns the transition counts of a group (or overall) as a dataframe: rows are 'entry' and the steps a client
+        # comes from, columns are the steps it goes to and 'exit'.
+
+        # Parameters
+        # group = group to return. Default is None which adds every group.
+        # first = only count the transitions into a step the client had never been at. Default is False.
+
+        matrix = (self.first_transitions if first else self.transitions)[self.rows(group)].sum(axis=0)
+
+        return pd.DataFrame(matrix, index=pd.Index(self.labels() + ['entry'], name='from'),
+                            columns=pd.Index(self.labels() + ['exit'], name='to'))
+
+    def probabilities(self, group=None):
+        # This method returns the transition probabilities of a group (or overall): each row of counts() divided by its total.
+
+        counts = self.counts(group)
+
+        return counts.div(counts.sum(axis=1).replace(0, np.nan), axis=0).fillna(0)
+
+    def transition_types(self, group=None):
+        # This method returns how many transitions of each type every step received: repeats (same step), forward (next step),
+        # skips (more than one step ahead) and backtracks (an earlier step, the errors of error_rate()).
+
+        matrix = self.transitions[self.rows(group)].sum(axis=0)[:self.n_steps, :self.n_steps]
+        from_steps, to_steps = np.indices(matrix.shape)
+
+        types = {'entries': self.transitions[self.rows(group)].sum(axis=0)[self.n_steps, :self.n_steps],
+                 'repeats': np.where(from_steps == to_steps, matrix, 0).sum(axis=0),
+                 'forward': np.where(to_steps == from_steps + 1, matrix, 0).sum(axis=0),
+                 'skips': np.where(to_steps > from_steps + 1, matrix, 0).sum(axis=0),
+                 'backtracks': np.where(to_steps < from_steps, matrix, 0).sum(axis=0)}
+
+        return pd.DataFrame(types, index=pd.Index(self.labels(), name='process_step'))
+
+    def error_rate(self, group=None):
+        # Same as error_rate(data, variation): every event is one transition and the backtracks are the errors.
+
+        matrix = self.transitions[self.rows(group)].sum(axis=0)
+
+        # Events at each step are the transitions into it, errors are the transitions into it from a later step.
+        event_counts = matrix[:, :self.n_steps].sum(axis=0)
+        error_counts = np.tril(matrix[:self.n_steps, :self.n_steps], k=-1).sum(axis=0)
+
+        total_errors = np.int64(error_counts.sum())
+        total_steps = int(event_counts.sum())
+        error_rate = total_errors / total_steps * 100
+
+        present = event_counts > 0
+        average_error_per_step = pd.Series(error_counts[present] / event_counts[present] * 100,
+                                           index=pd.Index(self.steps[present].astype(self.step_type), name='process_step'),
+                                           name='process_step')
+
+        return total_errors, total_steps, error_rate, average_error_per_step
+
+    def clients_at_step(self, group=None):
+        # Returns the number of unique clients that reached each step: the first visits into each step.
+
+        return self.first_transitions[self.rows(group)].sum(axis=0)[:, :self.n_steps].sum(axis=0)
+
+    def drop_off_rate(self, group=None):
+        # Same as drop_off_rate(data, variation), for funnels numbered 0, 1, 2, ...
+
+        clients_at_step = pd.Series(self.clients_at_step(group), index=self.steps.astype('int64'))
+        clients_at_step = clients_at_step[clients_at_step > 0]
+        clients_at_step = clients_at_step.reindex(range(clients_at_step.index.max() + 1), fill_value=0)
+        dropoff_rate = dropoff_from_counts(clients_at_step.to_frame().T).iloc[0]
+
+        return pd.DataFrame({'process_step': dropoff_rate.index.to_numpy(), 'dropoff_rate': dropoff_rate.to_numpy()})
+
+    def markov(self, group=None):
+        # This method treats the funnel of a group (or overall) as an absorbing Markov chain, with the steps as states and 'exit' as the
+        # absorbing state, and returns for every step:
+        #   - expected_visits: expected number of times a client is at the step (row of the fundamental matrix (I - Q)^-1 for 'entry').
+        #   - reach_probability: probability that a client reaches the step at least once, according to the chain.
+        #   - observed_reach: share of clients that actually reached it. A big gap with reach_probability means clients don't behave
+        #                     like a Markov chain at that step (their next step depends on more than the current step).
+
+        probabilities = self.probabilities(group).to_numpy()
+        transient = probabilities[:self.n_steps, :self.n_steps]
+        entry = probabilities[self.n_steps, :self.n_steps]
+        identity = np.eye(self.n_steps)
+
+        expected_visits = entry @ np.linalg.inv(identity - transient)
+
+        # Probability of ever reaching each step: the step is made absorbing and the chain is solved for it.
+        reach_probability = np.empty(self.n_steps)
+        for step in range(self.n_steps):
+            without_step = transient.copy()
+            without_step[:, step] = 0
+            without_step[step, :] = 0
+            hitting = np.linalg.solve(identity - without_step, transient[:, step])
+            hitting[step] = 1
+            reach_probability[step] = entry @ hitting
+
+        clients = self.transitions[self.rows(group)].sum(axis=0)[self.n_steps].sum()
+
+        return pd.DataFrame({'expected_visits': expected_visits, 'reach_probability': reach_probability,
+                             'observed_reach': self.clients_at_step(group) / clients},
+                            index=pd.Index(self.labels(), name='process_step'))